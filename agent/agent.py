@@ -1,22 +1,36 @@
-import streamlit as st
-from pydantic import BaseModel, Field
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field, create_model
 from typing import List, Annotated
-from langchain_openai import ChatOpenAI
-from langgraph.store.memory import InMemoryStore
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, MessagesState, START, END
 from langgraph.store.base import BaseStore
 from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda, RunnableParallel
 from langchain_core.runnables.config import RunnableConfig
 from langchain_core.tools import tool, InjectedToolCallId
-from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt import ToolNode, InjectedStore
 from langgraph.types import interrupt, Command
+from langgraph.constants import TAG_NOSTREAM
+from agent.config import AgentConfig
+from agent.memory_writer import MemoryWriter
+from agent.persistence import build_persistence
+from agent.sharded_store import StoreQuotaExceeded
+from agent.profile import (FinancialProfile, canonical_financial_information, conversation_messages, edited_profile,
+                           may_update_profile, messages_since, validate_edit)
+from agent.context import abuild_context, build_context, get_token_budget, latest_within_budget
+from agent.planner import compute_plan_figures, format_plan_figures
+from agent.metrics import TurnTrace, instrumented, record_cache, serve as serve_metrics, timed
+from agent.speculation import PlanSpeculator
+from agent.threads import index_turn, list_threads, prune_threads, threads_namespace, transcript
+from agent.plan_cache import PlanCache, plan_cache_key
 from langgraph.prebuilt import InjectedState # To access (read) the graph state inside the tools, you can use a special parameter annotation — InjectedState
 
-
-MODEL = st.secrets.get("OPENAI_MODEL")
-API_KEY = st.secrets.get("OPENAI_KEY")
-MODEL = ChatOpenAI(model=MODEL, api_key=API_KEY, temperature=1)
+logger = logging.getLogger(__name__)
 
 
 # Chatbot instruction
@@ -48,30 +62,41 @@ You are a financial assistant chatbot. Your primary goal is to help users create
 
 **Current User Financial Information:**  
 {financial_information}
+
+**Summary of the Earlier Conversation:**  
+{summary}
 """
 
 
 # System Memory Update Instruction
 GET_FINANCIAL_INFORMTATION_INSTRUCTION = """ You are an internal system tool responsible for updating the financial user information.
- Your goal is to extract and organize key information from the user's conversation history to personalize future interactions.
+ Your goal is to extract key information from the latest messages of the conversation to personalize future interactions.
 
 **Instructions:**
-1.  **Review provided data:** Carefully analyze the `CHAT_HISTORY` and the existing `CURRENT_USER_MEMORY`.
-2.  **Identify new information:** Extract any new, factual details about the user, such as:
-    * Financial Goal (e.g., "buy a car," "vacation")
-    * Goal Amount (the total cost of the goal)
-    * Current Savings
-    * Desired Time Period (the timeframe to achieve the goal)
-    * Monthly Expenses
-    * Salary
-3.  **Synthesize and update:** Combine the new information with the `CURRENT_USER_MEMORY`. 
-        If there are any conflicts, prioritize the most recent information from the chat history.
-4.  Based on the chat history below, update the user information
+1.  **Review provided data:** Carefully analyze the `NEW_MESSAGES` below, using `CURRENT_FINANCIAL_INFORMATION` as context.
+2.  **Identify new information:** Extract any new or changed, factual details about the user for these fields:
+    * financial_goal (e.g., "buy a car," "vacation")
+    * goal_amount (the total cost of the goal)
+    * savings (current savings)
+    * time_period (the timeframe to achieve the goal, e.g. "5 months")
+    * monthly_expenses
+    * salary (monthly)
+3.  **Only return changes:** Fill a field only if the new messages state it or change it. Leave every other field empty.
 
 **Important:** Only include information explicitly stated by the user. Do not make assumptions, guesses, or inferences.
 **Current Data:**
-CURRENT_FINANCIAL_INFORMATION: {financial_information}
-CHAT_HISTORY:
+CURRENT_FINANCIAL_INFORMATION:
+{financial_information}
+NEW_MESSAGES:
+"""
+
+# Rolling summary instruction
+SUMMARIZE_CONVERSATION_INSTRUCTION = """ You are an internal system tool that keeps a running summary of a conversation between a user and a financial assistant.
+Extend the `CURRENT_SUMMARY` with the new messages below. Keep every fact, number, decision and open question the user mentioned,
+drop greetings and small talk, and answer with the updated summary only, in a few short paragraphs.
+
+CURRENT_SUMMARY: {summary}
+NEW_MESSAGES:
 """
 
 GENERATE_FINANCIAL_PLAN_INSTRUCTION = """
@@ -80,6 +105,11 @@ The plan should be clear, actionable, and easy to understand.
 
 FINANCIAL_INFORMATION: {financial_information}
 
+COMPUTED_FIGURES (exact, already calculated from the data above):
+{plan_figures}
+
+Use the computed figures as given whenever you mention an amount, rate, date or feasibility. Do not recalculate them.
+
 Your response should be a well-structured plan that includes sections for:
 1. A summary of the user's current financial situation.
 2. Specific, actionable recommendations for budgeting and cash flow management.
@@ -91,8 +121,27 @@ Your response should be a well-structured plan that includes sections for:
 Ensure the tone is supportive and encouraging.
 """
 
+GENERATE_PLAN_SECTION_INSTRUCTION = """
+Write one section of a personalized financial plan based on the following user data.
+The section should be clear, actionable, and easy to understand.
+
+FINANCIAL_INFORMATION: {financial_information}
+
+COMPUTED_FIGURES (exact, already calculated from the data above):
+{plan_figures}
+
+Use the computed figures as given whenever you mention an amount, rate, date or feasibility. Do not recalculate them.
+
+Write only the "{section}" section: {description}
+The other sections of the plan are written separately, so do not repeat their content.
+
+Ensure the tone is supportive and encouraging.
+"""
+
 class State(MessagesState):
     financial_plan: dict
+    summary: str # Rolling summary of the messages that no longer fit the context budget
+    summary_watermark: str # ID of the last message folded into the summary
 
 class FinancialPlan(BaseModel):
     summary: str = Field(..., description="A concise overview of the current financial situation, including income, expenses, assets, liabilities, and overall financial health.")
@@ -102,6 +151,18 @@ class FinancialPlan(BaseModel):
     risk_and_emergency: List[str] = Field(..., description="Evaluation of risks (e.g., job loss, unexpected expenses) and recommendations for building an adequate emergency fund.")
     next_steps: List[str] = Field(..., description="Clear, encouraging actions the individual should take next to improve their financial situation.")
 
+# Cached plans are invalidated whenever the plan prompt or schema changes
+PLAN_PROMPT_VERSION = hashlib.sha256(
+    (GENERATE_FINANCIAL_PLAN_INSTRUCTION + json.dumps(FinancialPlan.model_json_schema(), sort_keys=True)).encode("utf-8")
+).hexdigest()[:16]
+SECTIONED_PLAN_PROMPT_VERSION = hashlib.sha256(
+    (GENERATE_PLAN_SECTION_INSTRUCTION + json.dumps(FinancialPlan.model_json_schema(), sort_keys=True)).encode("utf-8")
+).hexdigest()[:16]
+
+# One single-field model per plan section, for the sectioned generation mode
+PLAN_SECTIONS = {name: create_model(f"FinancialPlan_{name}", **{name: (field.annotation, field)})
+                 for name, field in FinancialPlan.model_fields.items()}
+
 def assistant(state: State, config: RunnableConfig, store: BaseStore):
     """Load memory from the store and use it to personalize the chatbot's response."""
     
@@ -111,57 +172,104 @@ def assistant(state: State, config: RunnableConfig, store: BaseStore):
     # Retrieve memory from the store
     namespace = (user_id, "user_information")
     key = "financial_information"
-    financial_information = store.get(namespace, key)
+    financial_profile = FinancialProfile.from_item(store.get(namespace, key))
 
-    # Extract the actual memory content if it exists and add a prefix
-    if financial_information:
-        # Value is a dictionary with a memory key
-        financial_information_content = financial_information.value.get('financial_information')
-    else:
-        financial_information_content = "No existing financial information found."
+    # Keep the chat history within the token budget, folding older turns into the summary
+    messages, summary, summary_update = build_context(state, get_token_budget(config), summarize_conversation)
 
     # Format the memory in the system prompt
-    system_msg = MODEL_SYSTEM_MESSAGE.format(financial_information=financial_information_content)
+    system_msg = MODEL_SYSTEM_MESSAGE.format(financial_information=financial_profile.to_prompt(),
+                                             summary=summary or "No earlier conversation.")
     
     # Respond using memory as well as the chat history
-    response = MODEL_WITH_TOOLS.invoke([SystemMessage(content=system_msg)]+state["messages"])
+    response = get_app().model_with_tools.invoke([SystemMessage(content=system_msg)]+messages)
+
+    return {"messages": response, **summary_update}
+
+async def aassistant(state: State, config: RunnableConfig, store: BaseStore):
+    """Async version of `assistant`."""
 
-    return {"messages": response}
+    user_id = config["configurable"]["user_id"]
+    financial_profile = FinancialProfile.from_item(await store.aget((user_id, "user_information"), "financial_information"))
+    messages, summary, summary_update = await abuild_context(state, get_token_budget(config), asummarize_conversation)
+    system_msg = MODEL_SYSTEM_MESSAGE.format(financial_information=financial_profile.to_prompt(),
+                                             summary=summary or "No earlier conversation.")
+    response = await get_app().model_with_tools.ainvoke([SystemMessage(content=system_msg)]+messages)
+    return {"messages": response, **summary_update}
+
+def summarize_conversation(summary, messages):
+    """Extend the rolling conversation summary with `messages`."""
+    system_msg = SUMMARIZE_CONVERSATION_INSTRUCTION.format(summary=summary or "No summary yet.")
+    # Tagged so the summary never shows up in the streamed reply
+    response = get_app().model.with_config(tags=["summarize", TAG_NOSTREAM]).invoke([SystemMessage(content=system_msg)]+messages)
+    return response.content
+
+async def asummarize_conversation(summary, messages):
+    """Async version of `summarize_conversation`."""
+    system_msg = SUMMARIZE_CONVERSATION_INSTRUCTION.format(summary=summary or "No summary yet.")
+    response = await get_app().model.with_config(tags=["summarize", TAG_NOSTREAM]).ainvoke([SystemMessage(content=system_msg)]+messages)
+    return response.content
 
 def extract_write_information(state: State, config: RunnableConfig, store: BaseStore):
-    """Reflect on the chat history and save a memory to the store."""
+    """Merge the messages added since the last extraction into the stored financial profile."""
     
-    # Get the user ID from the config
+    # Get the user and thread IDs from the config
     user_id = config["configurable"]["user_id"]
-
-    # Retrieve existing memory from the store
-    namespace = (user_id, "user_information")
-    financial_information = store.get(namespace, "financial_information")
-        
-    # Extract the memory
-    if financial_information:
-        financial_information_content = financial_information.value.get('financial_information')
-    else:
-        financial_information_content = "No existing financial information found."
-
-    # Format the memory in the system prompt
-    system_msg = GET_FINANCIAL_INFORMTATION_INSTRUCTION.format(financial_information=financial_information_content)
-    new_financial_information = MODEL.invoke([SystemMessage(content=system_msg)]+state['messages'])
-    key = "financial_information"
-
-    # Write value as a dictionary with a memory key
-    store.put(namespace, key, {"financial_information": new_financial_information.content})
+    thread_id = config["configurable"]["thread_id"]
+
+    # Extraction runs after the turn, so it gets its own trace
+    trace = TurnTrace(kind="memory", thread_id=thread_id, user_id=user_id, default_step="extract_write_information")
+    try:
+        with trace.activate(), timed("extract_write_information"):
+            _extract_write_information(state, config, store, trace, user_id, thread_id)
+    finally:
+        trace.finish()
+
+def _extract_write_information(state, config, store, trace, user_id, thread_id):
+    # Only the messages after this thread's watermark are new to the extractor
+    watermark_namespace = (user_id, "extraction_watermarks")
+    watermark = store.get(watermark_namespace, thread_id)
+    new_messages = messages_since(state["messages"], watermark.value["message_id"] if watermark else None)
+    if not new_messages:
+        return
+
+    # Skip the LLM call when no user message could change the profile (e.g. "thanks")
+    if may_update_profile(new_messages):
+        # Retrieve existing memory from the store
+        namespace = (user_id, "user_information")
+        key = "financial_information"
+        financial_profile = FinancialProfile.from_item(store.get(namespace, key))
+
+        # Format the memory in the system prompt
+        system_msg = GET_FINANCIAL_INFORMTATION_INSTRUCTION.format(financial_information=financial_profile.to_prompt())
+        new_conversation = latest_within_budget(conversation_messages(new_messages), get_token_budget(config))
+        changes = get_app().model.with_structured_output(FinancialProfile).invoke(
+            [SystemMessage(content=system_msg)] + new_conversation, config={"callbacks": [trace]})
+
+        # Another session of the user may have written the profile during the call, so merge into the latest one
+        with profile_lock(namespace):
+            financial_profile = FinancialProfile.from_item(store.get(namespace, key))
+            updated_profile = financial_profile.merge(changes)
+
+            # Write value as a dictionary with a memory key
+            if updated_profile != financial_profile:
+                store.put(namespace, key, {"financial_information": updated_profile.model_dump()})
+
+    store.put(watermark_namespace, thread_id, {"message_id": new_messages[-1].id})
 
 def should_continue(state: State):
     last_message = state["messages"][-1]
     if last_message.tool_calls:
         return "tools"
-    return "extract"
+    # Memory extraction runs in the background (see `memory_writer`), so the reply is returned right away
+    return END
 
 
 @tool("generate_financial_plan")
 def generate_financial_plan(financial_information: dict,
-                            tool_call_id: Annotated[str, InjectedToolCallId]) -> Command:
+                            tool_call_id: Annotated[str, InjectedToolCallId],
+                            config: RunnableConfig,
+                            store: Annotated[BaseStore, InjectedStore()]) -> Command:
     """
     Generate a personalized financial plan based on the provided user information.
 
@@ -176,29 +284,149 @@ def generate_financial_plan(financial_information: dict,
                 - salary (float): Monthly income/salary.
 
         tool_call_id (str): An auto-injected identifier for tracking the tool call.
+        config (RunnableConfig): The auto-injected run configuration (holds the user ID).
+        store (BaseStore): The auto-injected long-term memory store.
 
     Returns:
         Command: A command containing the generated financial plan.
     """
 
-    response = interrupt({
-                        "question": { 
-                            "text": "Please review the current Financial Information. Do you agree with this information, or would you like to update any part of it before I proceed?",
-                            "options": ["ACCEPT", "DECLINE"]
-                         },
-                        "financial_information": financial_information            
-                        })    
-    
-    if response == "ACCEPT":
-        pass
-    elif response == "edit":
-        pass # To do https://langchain-ai.github.io/langgraph/how-tos/human_in_the_loop/add-human-in-the-loop/#review-tool-calls
-    else:
-        raise ValueError(f"Unknown response type: {response['type']}")
+    # The model may name the profile fields its own way; the figures, review and plan use the profile names
+    financial_information = canonical_financial_information(financial_information)
+    # The plan is generated while the user reviews the information, and only used if they accept it
+    speculate_plan(financial_information)
+    decision, changes = review_financial_information(financial_information)
+    if decision == "DECLINE":
+        discard_speculative_plan(financial_information)
+        return declined_command(tool_call_id)
+    if changes:
+        # The speculated plan was for the information before the edit
+        discard_speculative_plan(financial_information)
+        financial_information = {**financial_information, **changes}
+        with over_quota_logged(config, "profile edit"):
+            save_profile_edit(store, config["configurable"]["user_id"], changes)
+
+    financial_plan = generate_plan(financial_information)
+
+    # Keep the user's latest plan in the long-term store for exports (see export_plans.py)
+    with over_quota_logged(config, "latest plan"):
+        store.put((config["configurable"]["user_id"], "financial_plan"), "latest", latest_plan_value(financial_plan))
+    return plan_command(financial_plan, tool_call_id)
+
+
+@tool("generate_financial_plan")
+async def agenerate_financial_plan(financial_information: dict,
+                                   tool_call_id: Annotated[str, InjectedToolCallId],
+                                   config: RunnableConfig,
+                                   store: Annotated[BaseStore, InjectedStore()]) -> Command:
+    """
+    Generate a personalized financial plan based on the provided user information.
+
+    Parameters:
+        financial_information (dict): Dictionary containing the user's financial data. 
+            Expected keys:
+                - financial_goal (str): The user's main financial objective (e.g., "buy a house").
+                - goal_amount (float): Target amount needed to achieve the goal.
+                - savings (float): Current savings balance.
+                - time_period (str): Time horizon to reach the goal, in months or years.
+                - monthly_expenses (float): Average monthly expenses.
+                - salary (float): Monthly income/salary.
+
+        tool_call_id (str): An auto-injected identifier for tracking the tool call.
+        config (RunnableConfig): The auto-injected run configuration (holds the user ID).
+        store (BaseStore): The auto-injected long-term memory store.
+
+    Returns:
+        Command: A command containing the generated financial plan.
+    """
+
+    financial_information = canonical_financial_information(financial_information)
+    speculate_plan(financial_information)
+    decision, changes = review_financial_information(financial_information)
+    if decision == "DECLINE":
+        discard_speculative_plan(financial_information)
+        return declined_command(tool_call_id)
+    if changes:
+        discard_speculative_plan(financial_information)
+        financial_information = {**financial_information, **changes}
+        # The profile lock is a thread lock, so the read-modify-write runs off the event loop
+        with over_quota_logged(config, "profile edit"):
+            await asyncio.to_thread(save_profile_edit, get_app().across_thread_memory, config["configurable"]["user_id"], changes)
+
+    financial_plan = await agenerate_plan(financial_information)
+    with over_quota_logged(config, "latest plan"):
+        await store.aput((config["configurable"]["user_id"], "financial_plan"), "latest", latest_plan_value(financial_plan))
+    return plan_command(financial_plan, tool_call_id)
+
+
+def review_financial_information(financial_information):
+    """Ask the user to review `financial_information` before a plan is generated.
+
+    The answer is "ACCEPT", "DECLINE" or {"type": "edit", "financial_information": {field: value}}
+    to fix some fields. Edits are validated locally (an invalid one is asked
+    again, with the error) and accepted without another turn of the assistant.
+
+    Returns the decision ("ACCEPT" or "DECLINE") and the validated edits.
+    """
+
+    error = None
+    while True:
+        question = {
+                    "question": { 
+                        "text": "Please review the current Financial Information. Do you agree with this information, or would you like to update any part of it before I proceed?",
+                        "options": ["ACCEPT", "DECLINE"]
+                     },
+                    "financial_information": financial_information            
+                    }
+        if error is not None:
+            question["error"] = error
+        response = interrupt(question)
+
+        if response in ("ACCEPT", "DECLINE"):
+            return response, {}
+        elif isinstance(response, dict) and response.get("type") == "edit":
+            try:
+                return "ACCEPT", validate_edit(response.get("financial_information") or {})
+            except ValueError as invalid:
+                error = str(invalid)
+        else:
+            raise ValueError(f"Unknown review response: {response!r}")
+
+@contextmanager
+def over_quota_logged(config, what):
+    """Log and skip a store write that would take the user over their quota, instead of failing the turn."""
+    try:
+        yield
+    except StoreQuotaExceeded as error:
+        logger.warning("Skipped saving the %s of thread %s: %s", what, config["configurable"]["thread_id"], error)
+
+def profile_lock(namespace):
+    """Lock held around every read-modify-write of a user's profile (see `ShardedStore.lock`)."""
+    return get_app().across_thread_memory.lock(namespace, "financial_information")
+
+def save_profile_edit(store, user_id, changes):
+    """Write the fields edited in the review into the user's profile."""
+    namespace = (user_id, "user_information")
+    with profile_lock(namespace):
+        store.put(namespace, "financial_information", edited_profile_value(store.get(namespace, "financial_information"), changes))
+
+def edited_profile_value(item, changes):
+    """Store value of the user's profile with the fields edited in the review."""
+    profile = edited_profile(FinancialProfile.from_item(item), changes)
+    return {"financial_information": profile.model_dump()}
+
+def latest_plan_value(financial_plan):
+    return {"financial_plan": financial_plan, "updated_at": datetime.now(timezone.utc).isoformat()}
 
-    system_msg = GENERATE_FINANCIAL_PLAN_INSTRUCTION.format(financial_information=financial_information)
-    financial_plan = MODEL.with_structured_output(FinancialPlan).invoke([SystemMessage(content=system_msg)])
-    financial_plan = financial_plan.model_dump()
+def declined_command(tool_call_id):
+    return Command(update={
+        "messages": [
+            ToolMessage("The user declined the financial information. Ask them what they would like to change "
+                        "before generating the plan.", tool_call_id=tool_call_id)
+        ]
+    })
+
+def plan_command(financial_plan, tool_call_id):
     #return financial_plan.model_dump()
     return Command(update={
         "financial_plan": financial_plan,
@@ -208,63 +436,464 @@ def generate_financial_plan(financial_information: dict,
     }) # reference:  https://langchain-ai.github.io/langgraph/how-tos/tool-calling/?_gl=1*1rfn5oz*_gcl_au*MTIxNjc5NTc5Ny4xNzUyMDkzMDY2*_ga*MzU1ODY4ODkzLjE3NTIwOTMwNjY.*_ga_47WX3HKKY2*czE3NTc1MTQ4ODIkbzQxJGcxJHQxNzU3NTE1OTE5JGo2MCRsMCRoMA..#short-term-memory
 
 
-def invoke(message, thread_id="1", user_id="1"):
-    
-    
+def plan_key(financial_information):
+    sectioned = get_app().config.plan_generation == "sectioned"
+    version = SECTIONED_PLAN_PROMPT_VERSION if sectioned else PLAN_PROMPT_VERSION
+    return plan_cache_key(financial_information, version, get_app().model_name)
+
+def section_key(financial_information, section):
+    return plan_cache_key(financial_information, f"{SECTIONED_PLAN_PROMPT_VERSION}/{section}", get_app().model_name)
+
+def speculate_plan(financial_information):
+    """Start generating the plan in the background, unless it is cached, already started or disabled.
+
+    The tool runs again from the start when the review is answered, so this is
+    called a second time for the same information and then finds its plan.
+    """
+    speculator = get_app().speculator
+    cache_key = plan_key(financial_information)
+    if speculator is not None and cache_key not in get_app().plan_cache:
+        speculator.start(cache_key, financial_information)
+
+def discard_speculative_plan(financial_information):
+    if get_app().speculator is not None:
+        get_app().speculator.discard(plan_key(financial_information))
+
+def speculative_plan(financial_information):
+    """Generate a plan in a speculation thread, traced on its own since it runs outside any turn."""
+    trace = TurnTrace(kind="speculation", default_step="generate_plan")
+    try:
+        with trace.activate(), timed("speculative_plan"):
+            # Its sections aren't cached: a declined plan must never be reused
+            return create_plan(financial_information, config={"callbacks": [trace]}, cache_sections=False)
+    finally:
+        trace.finish()
+
+def take_speculative_plan(cache_key):
+    """Future of the plan speculated for `cache_key`, or None."""
+    speculator = get_app().speculator
+    future = speculator.take(cache_key) if speculator is not None else None
+    if speculator is not None:
+        record_cache("speculation", future is not None)
+    return future
+
+def generate_plan(financial_information):
+    """Generate the financial plan for `financial_information`, reusing a cached or speculated plan for the same data."""
+
+    cache_key = plan_key(financial_information)
+    financial_plan = get_app().plan_cache.get(cache_key)
+    if financial_plan is not None:
+        return financial_plan
+
+    financial_plan = None
+    future = take_speculative_plan(cache_key)
+    if future is not None:
+        try:
+            financial_plan = future.result()
+        except Exception:
+            logger.exception("Speculative plan generation failed, generating it again")
+    if financial_plan is None:
+        financial_plan = create_plan(financial_information)
+    get_app().plan_cache.put(cache_key, financial_plan)
+    return financial_plan
+
+async def agenerate_plan(financial_information):
+    """Async version of `generate_plan`."""
+
+    cache_key = plan_key(financial_information)
+    financial_plan = get_app().plan_cache.get(cache_key)
+    if financial_plan is not None:
+        return financial_plan
+
+    financial_plan = None
+    future = take_speculative_plan(cache_key)
+    if future is not None:
+        try:
+            financial_plan = await asyncio.wrap_future(future)
+        except Exception:
+            logger.exception("Speculative plan generation failed, generating it again")
+    if financial_plan is None:
+        financial_plan = await acreate_plan(financial_information)
+    get_app().plan_cache.put(cache_key, financial_plan)
+    return financial_plan
+
+def plan_prompt(financial_information):
+    # The arithmetic is done locally; the model only writes the plan around these figures
+    plan_figures = compute_plan_figures(financial_information)
+    system_msg = GENERATE_FINANCIAL_PLAN_INSTRUCTION.format(financial_information=financial_information,
+                                                            plan_figures=format_plan_figures(plan_figures))
+    return [SystemMessage(content=system_msg)]
+
+def create_plan(financial_information, config=None, cache_sections=True):
+    """Call the model for a new plan: one structured call, or parallel sections (`AgentConfig.plan_generation`)."""
+    if get_app().config.plan_generation == "sectioned":
+        cached, sections = plan_sections(financial_information, cache_sections)
+        # One worker per section: the default pool (cpu_count + 4) runs them in waves on small hosts
+        generated = sections.invoke(None, config={**(config or {}), "max_concurrency": len(sections.steps__)}) if sections else {}
+        return assemble_plan(cached, generated)
+    return get_app().model.with_structured_output(FinancialPlan).invoke(plan_prompt(financial_information), config=config).model_dump()
+
+async def acreate_plan(financial_information, config=None, cache_sections=True):
+    """Async version of `create_plan`."""
+    if get_app().config.plan_generation == "sectioned":
+        cached, sections = plan_sections(financial_information, cache_sections)
+        generated = await sections.ainvoke(None, config=config) if sections else {}
+        return assemble_plan(cached, generated)
+    plan = await get_app().model.with_structured_output(FinancialPlan).ainvoke(plan_prompt(financial_information), config=config)
+    return plan.model_dump()
+
+def plan_sections(financial_information, cache_sections=True):
+    """Split the plan into the sections already cached and a RunnableParallel writing the others.
+
+    Every section gets the same computed figures, and is retried on its own if
+    its call fails. RunnableParallel runs the sections on a thread pool with
+    `invoke` and concurrently on the event loop with `ainvoke`, so the plan takes
+    about as long as its longest section. With `cache_sections` the written
+    sections are added to the plan cache.
+    """
+    # The arithmetic is done once, for all the sections
+    plan_figures = format_plan_figures(compute_plan_figures(financial_information))
+    attempts = get_app().config.plan_section_attempts
+
+    cached, branches = {}, {}
+    for section, schema in PLAN_SECTIONS.items():
+        cached_section = get_app().plan_cache.get(section_key(financial_information, section))
+        if cached_section is not None:
+            cached[section] = cached_section["value"]
+            continue
+        system_msg = GENERATE_PLAN_SECTION_INSTRUCTION.format(financial_information=financial_information,
+                                                              plan_figures=plan_figures,
+                                                              section=section.replace("_", " "),
+                                                              description=FinancialPlan.model_fields[section].description)
+        # Each section is cached as soon as it is written, so a failed plan only redoes the failed sections
+        branches[section] = (RunnableLambda(lambda _, prompt=[SystemMessage(content=system_msg)]: prompt)
+                             | get_app().model.with_structured_output(schema).with_retry(stop_after_attempt=attempts)
+                             | RunnableLambda(lambda result, section=section: getattr(result, section)))
+        if cache_sections:
+            branches[section] |= RunnableLambda(lambda value, section=section: cache_section(financial_information, section, value))
+    return cached, RunnableParallel(branches) if branches else None
+
+def cache_section(financial_information, section, value):
+    get_app().plan_cache.put(section_key(financial_information, section), {"value": value})
+    return value
+
+def assemble_plan(cached, generated):
+    """Validate the full plan from its sections."""
+    return FinancialPlan(**cached, **generated).model_dump()
+
+def has_pending_interrupt(config):
+    """Whether a thread is waiting on a review interrupt.
+
+    The thread index records it after every turn (see `record_turn`), so the lookup
+    is a single store get whatever the size of the thread. Only a thread missing
+    from the index (a new thread, which has no checkpoint yet) is looked up in its
+    latest checkpoint.
+    """
+    configurable = config["configurable"]
+    entry = get_app().across_thread_memory.get(threads_namespace(configurable["user_id"]), configurable["thread_id"])
+    if entry is not None:
+        return bool(entry.value.get("pending_interrupt"))
+    return len(get_app().graph.get_state(config).interrupts) > 0
+
+async def ahas_pending_interrupt(config):
+    """Async version of `has_pending_interrupt`."""
+    configurable = config["configurable"]
+    entry = await get_app().across_thread_memory.aget(threads_namespace(configurable["user_id"]), configurable["thread_id"])
+    if entry is not None:
+        return bool(entry.value.get("pending_interrupt"))
+    return len((await get_app().async_graph.aget_state(config)).interrupts) > 0
+
+def prepare_turn(message, thread_id, user_id, callbacks=None):
+    """Build the config and the graph input for a user message."""
+
     config = {"configurable": {"thread_id": thread_id, # We supply a thread ID for short-term (within-thread) memory
-                               "user_id": user_id}} # We supply a user ID for long-term (across-thread) memory 
+                               "user_id": user_id, # We supply a user ID for long-term (across-thread) memory
+                               "context_token_budget": get_app().config.context_token_budget}}
 
-    # The states are returned in reverse chronological order.
-    states = list(graph.get_state_history(config))
-    
-    # get the latest state
-    if len(states) > 0:
-        last_state = states[0]
-        interrupts = last_state.interrupts
-    else:
-        interrupts = []
+    # Callback handlers (tracing, benchmarks) see every node and model call of the turn
+    if callbacks:
+        config["callbacks"] = callbacks
+
+    # The thread index tells whether the thread is waiting on an interrupt
+    with timed("interrupt_lookup"):
+        pending_interrupt = has_pending_interrupt(config)
 
-    if len(interrupts) > 0:
+    if pending_interrupt:
         user_message = Command(resume=message)
     else:
         user_message = {"messages":  [HumanMessage(content=message)] }
-
-    response = graph.invoke(user_message, config=config)
+    return config, user_message
+
+def record_turn(thread_id, user_id, message, interruption):
+    """Update the user's thread index after a turn, deleting the threads pruned from it."""
+    app = get_app()
+    config = {"configurable": {"thread_id": thread_id, "user_id": user_id}}
+    with timed("thread_index"), over_quota_logged(config, "thread index entry"):
+        if index_turn(app.across_thread_memory, user_id, thread_id, message, interruption is not None):
+            for dropped in prune_threads(app.across_thread_memory, user_id, app.config.threads_per_user):
+                app.within_thread_memory.delete_thread(dropped)
+                app.persistence.forget(dropped)
+                # Keep the user's store items within their quota
+                app.across_thread_memory.delete((user_id, "extraction_watermarks"), dropped)
+
+def get_threads(user_id):
+    """The user's threads from the thread index, most recently active first (no checkpoint is read)."""
+    return list_threads(get_app().across_thread_memory, user_id, limit=get_app().config.threads_per_user)
+
+def load_thread(thread_id, user_id):
+    """Read a thread from its latest checkpoint in a single read.
+
+    Returns the `transcript` of the thread, its pending review interrupt (or None)
+    and its latest financial plan (or None); None if the thread no longer exists.
+    """
+    config = {"configurable": {"thread_id": thread_id, "user_id": user_id}}
+    snapshot = get_app().graph.get_state(config)
+    if not snapshot.values:
+        # Evicted by retention: drop it from the index too
+        get_app().across_thread_memory.delete(threads_namespace(user_id), thread_id)
+        return None
+    interruption = snapshot.interrupts[0].value if snapshot.interrupts else None
+    return transcript(snapshot.values.get("messages", [])), interruption, snapshot.values.get("financial_plan")
+
+def invoke(message, thread_id="1", user_id="1", callbacks=None):
     
-    if "__interrupt__" in response:
-        interruption = response["__interrupt__"][0].value
-    else:
-        interruption = None
+    # Breakdown of the turn by step, logged and added to the metrics when it ends
+    trace = TurnTrace(thread_id=thread_id, user_id=user_id)
+    with trace.activate():
+        config, user_message = prepare_turn(message, thread_id, user_id, [trace] + list(callbacks or []))
+
+        response = get_app().graph.invoke(user_message, config=config)
+        interruption = response["__interrupt__"][0].value if "__interrupt__" in response else None
+        with timed("retention"):
+            get_app().persistence.after_turn(thread_id)
+        record_turn(thread_id, user_id, message, interruption)
+    trace.finish()
+    
+    if interruption is None:
+        # Update the long-term memory off the critical path
+        get_app().memory_writer.submit(response, config)
     return response, interruption
 
+async def ainvoke(message, thread_id="1", user_id="1", callbacks=None):
+    """Async version of `invoke`, running the turn on `async_graph`.
+
+    Many conversations can run concurrently on one event loop: nodes only await
+    the model and the store, and the blocking retention work runs in a thread.
+    """
+
+    trace = TurnTrace(thread_id=thread_id, user_id=user_id)
+    config = {"configurable": {"thread_id": thread_id, "user_id": user_id,
+                               "context_token_budget": get_app().config.context_token_budget},
+              "callbacks": [trace] + list(callbacks or [])}
+
+    with trace.activate():
+        with timed("interrupt_lookup"):
+            pending_interrupt = await ahas_pending_interrupt(config)
+        if pending_interrupt:
+            user_message = Command(resume=message)
+        else:
+            user_message = {"messages":  [HumanMessage(content=message)] }
+
+        response = await get_app().async_graph.ainvoke(user_message, config=config)
+        interruption = response["__interrupt__"][0].value if "__interrupt__" in response else None
+        with timed("retention"):
+            await asyncio.to_thread(get_app().persistence.after_turn, thread_id)
+        await asyncio.to_thread(record_turn, thread_id, user_id, message, interruption)
+    trace.finish()
+
+    if interruption is None:
+        # The writer's threads run the extraction, so it never blocks the event loop
+        get_app().memory_writer.submit(response, config)
+    return response, interruption
+
+def stream(message, thread_id="1", user_id="1", callbacks=None):
+    """Run a turn like `invoke`, yielding events as soon as they happen.
+
+    Every event is a dictionary with a "type":
+        - "token": {"content"} a piece of the assistant reply.
+        - "tool_start": {"name", "args"} the assistant called a tool.
+        - "interrupt": {"value"} the tool is waiting on the user's review.
+        - "financial_plan": {"value"} a new plan was generated.
+        - "done": {"response", "interruption", "trace"} the same values `invoke` returns, and
+          the `TurnTrace` of the turn; always last.
+    """
+
+    trace = TurnTrace(thread_id=thread_id, user_id=user_id)
+    with trace.activate():
+        config, user_message = prepare_turn(message, thread_id, user_id, [trace] + list(callbacks or []))
+
+    interruption = None
+    # The trace is only current while the graph runs, not while the caller handles the events
+    events = get_app().graph.stream(user_message, config=config, stream_mode=["messages", "updates"])
+    try:
+        for mode, chunk in trace.activated(events):
+            if mode == "messages":
+                message_chunk, metadata = chunk
+                if metadata.get("langgraph_node") == "assistant" and isinstance(message_chunk.content, str) and message_chunk.content:
+                    yield {"type": "token", "content": message_chunk.content}
+                continue
+
+            for node, update in chunk.items():
+                if node == "__interrupt__":
+                    interruption = update[0].value
+                    yield {"type": "interrupt", "value": interruption}
+                    continue
+                # Nodes returning a Command (like the tools node) report a list of updates
+                for node_update in update if isinstance(update, list) else [update]:
+                    if not isinstance(node_update, dict):
+                        continue
+                    if node == "assistant":
+                        for tool_call in getattr(node_update.get("messages"), "tool_calls", []):
+                            yield {"type": "tool_start", "name": tool_call["name"], "args": tool_call["args"]}
+                    if "financial_plan" in node_update:
+                        yield {"type": "financial_plan", "value": node_update["financial_plan"]}
+    except GeneratorExit:
+        # The caller stopped reading mid-reply (e.g. a Streamlit rerun): the graph stops at its
+        # last checkpoint, which is still recorded like a finished turn
+        events.close()
+        finish_stream(trace, config, thread_id, user_id, message, None)
+        raise
+
+    response = finish_stream(trace, config, thread_id, user_id, message, interruption)
+    yield {"type": "done", "response": response, "interruption": interruption, "trace": trace}
+
+def finish_stream(trace, config, thread_id, user_id, message, interruption):
+    """The bookkeeping after a streamed turn; returns the state of the thread.
+
+    `interruption` is None when it is read back from the checkpoint, for streams
+    closed before their end.
+    """
+    with trace.activate():
+        with timed("retention"):
+            get_app().persistence.after_turn(thread_id)
+        snapshot = get_app().graph.get_state(config)
+        if interruption is None and snapshot.interrupts:
+            interruption = snapshot.interrupts[0].value
+        record_turn(thread_id, user_id, message, interruption)
+        response = dict(snapshot.values)
+    trace.finish()
+    if interruption is None:
+        # Update the long-term memory off the critical path
+        get_app().memory_writer.submit(response, config)
+    return response
+
+def build_graph(assistant_node, tool_node):
+    """Define the graph around an assistant node and a tool node."""
+    builder = StateGraph(State)
+    builder.add_node("assistant", assistant_node)
+    builder.add_node("tools", tool_node)
+    builder.add_edge(START, "assistant")
+    builder.add_conditional_edges(
+        "assistant",
+        should_continue,
+        {"tools": "tools", END: END}
+    )
+    builder.add_edge("tools", "assistant")
+    return builder
+
 tools = [generate_financial_plan]
-MODEL_WITH_TOOLS = MODEL.bind_tools(tools)
-tool_node = ToolNode(tools)
-
-# Define the graph
-builder = StateGraph(State)
-builder.add_node("assistant", assistant)
-builder.add_node("tools", tool_node)
-builder.add_node("extract_write_information", extract_write_information)
-builder.add_edge(START, "assistant")
-builder.add_conditional_edges(
-    "assistant",
-    should_continue,
-    {"tools": "tools", "extract": "extract_write_information"}
-)
-builder.add_edge("tools", "assistant")
-builder.add_edge("extract_write_information", END)
-
-# Store for long-term (across-thread) memory
-across_thread_memory = InMemoryStore()
-
-# Checkpointer for short-term (within-thread) memory
-within_thread_memory = MemorySaver()
-
-# Compile the graph with the checkpointer fir and store
-graph = builder.compile(checkpointer=within_thread_memory, store=across_thread_memory)
-
-#graph_image = graph.get_graph(xray=True).draw_mermaid_png()
+
+class AgentApp:
+    """The model, compiled graphs and memory of the agent.
+
+    Nothing is built when the module is imported: `get_app` builds the app on
+    first use, once per process, and `configure` builds it from an injected
+    config and/or model (e.g. a fake local model in benchmarks).
+    """
+
+    def __init__(self, config: AgentConfig, model=None):
+        if model is None:
+            from langchain_openai import ChatOpenAI
+            model = ChatOpenAI(model=config.openai_model, api_key=config.openai_key, temperature=config.temperature)
+        self.config = config
+        self.model = model
+        self.model_name = getattr(model, "model_name", type(model).__name__)
+        self.model_with_tools = model.bind_tools(tools)
+
+        # Checkpointer and store backends ("memory" or "sqlite"), with checkpoint retention,
+        # timing every checkpoint and store operation
+        self.persistence = build_persistence(config.persistence_backend,
+                                             sqlite_path=config.sqlite_path,
+                                             keep_checkpoints=config.checkpoints_per_thread,
+                                             idle_ttl=config.thread_idle_ttl,
+                                             store_limits={"max_users": config.store_max_users,
+                                                           "max_items_per_user": config.store_items_per_user,
+                                                           "max_bytes_per_user": config.store_bytes_per_user},
+                                             instrument=instrumented)
+
+        # Store for long-term (across-thread) memory
+        self.across_thread_memory = self.persistence.store
+
+        # Checkpointer for short-term (within-thread) memory
+        self.within_thread_memory = self.persistence.checkpointer
+
+        self.metrics_server = serve_metrics(config.metrics_port) if config.metrics_port else None
+
+        # Compile the graph with the checkpointer and store, and the same graph with async nodes for `ainvoke`
+        self.graph = build_graph(assistant, ToolNode(tools)).compile(
+            checkpointer=self.within_thread_memory, store=self.across_thread_memory)
+        self.async_graph = build_graph(aassistant, ToolNode([agenerate_financial_plan])).compile(
+            checkpointer=self.within_thread_memory, store=self.across_thread_memory)
+
+        # Generated plans by normalized financial information (optionally spilled to disk)
+        self.plan_cache = PlanCache(max_entries=config.plan_cache_entries,
+                                    directory=config.plan_cache_dir,
+                                    max_disk_bytes=config.plan_cache_disk_bytes)
+
+        # Plans generated while the user reviews their financial information
+        self.speculator = (PlanSpeculator(speculative_plan, max_entries=config.speculative_plans)
+                           if config.speculative_plans else None)
+
+        # Background writer that runs `extract_write_information` after each completed turn
+        self.memory_writer = MemoryWriter(extract_write_information, self.across_thread_memory)
+
+    def close(self):
+        """Flush the memory writer, then stop the background threads, the metrics server and the backends."""
+        self.memory_writer.close()
+        if self.speculator is not None:
+            self.speculator.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        self.persistence.close()
+
+_app = None
+_app_lock = threading.Lock()
+
+def get_app():
+    """Return the process-wide AgentApp, built from the Streamlit secrets on first use."""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = AgentApp(AgentConfig.from_secrets())
+    return _app
+
+def configure(config=None, model=None):
+    """Replace the process-wide AgentApp with one built from `config` and `model`.
+
+    The previous app is closed first, which frees its metrics port for the new one.
+    """
+    global _app
+    with _app_lock:
+        if _app is not None:
+            previous, _app = _app, None
+            previous.close()
+        _app = AgentApp(config or AgentConfig(), model=model)
+    return _app
+
+# Names that used to be module globals, now resolved lazily from the app
+_APP_ATTRIBUTES = {"MODEL": "model", "MODEL_WITH_TOOLS": "model_with_tools", "graph": "graph",
+                   "async_graph": "async_graph", "persistence": "persistence", "plan_cache": "plan_cache",
+                   "memory_writer": "memory_writer", "across_thread_memory": "across_thread_memory",
+                   "within_thread_memory": "within_thread_memory"}
+
+def __getattr__(name):
+    if name in _APP_ATTRIBUTES:
+        return getattr(get_app(), _APP_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+#graph_image = get_app().graph.get_graph(xray=True).draw_mermaid_png()
 #with open("agent.png", "wb") as f:
 #    f.write(graph_image)
 
@@ -272,6 +901,8 @@ if __name__ == "__main__":
     while True:
         user_message = input("You: ")
         if user_message.lower() == "exit":
+            # Let pending memory extractions reach the store before leaving
+            get_app().memory_writer.close()
             break
         
         response, interruption = invoke(user_message)
@@ -0,0 +1,33 @@
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+
+
+class AgentConfig(BaseModel):
+    """Settings of the agent. Every field can be set in the Streamlit secrets under its upper-case name."""
+    openai_model: Optional[str] = Field(None, description="OpenAI chat model name.")
+    openai_key: Optional[str] = Field(None, description="OpenAI API key.")
+    temperature: float = 1
+    persistence_backend: str = Field("memory", description="\"memory\" or \"sqlite\".")
+    sqlite_path: str = "data/saveup.sqlite"
+    checkpoints_per_thread: int = 20
+    thread_idle_ttl: float = 7 * 24 * 3600
+    threads_per_user: int = 50
+    context_token_budget: int = Field(3000, description="Approximate tokens of conversation sent with each model call.")
+    store_max_users: int = Field(10_000, description="Users kept in the store; the least recently active are evicted (memory backend).")
+    store_items_per_user: int = 500
+    store_bytes_per_user: int = 1024 * 1024
+    plan_cache_entries: int = 256
+    plan_cache_dir: Optional[str] = None
+    plan_cache_disk_bytes: int = 50 * 1024 * 1024
+    plan_generation: Literal["single", "sectioned"] = Field("single", description="\"single\" structured call or parallel \"sectioned\" calls.")
+    plan_section_attempts: int = Field(3, description="Attempts per section in the sectioned mode.")
+    speculative_plans: int = Field(64, description="Plans generated ahead of the review answer (0 disables).")
+    metrics_port: Optional[int] = Field(None, description="Serve Prometheus metrics on this port.")
+
+    @classmethod
+    def from_secrets(cls):
+        """Read the settings from `st.secrets`; Streamlit is only imported here."""
+        import streamlit as st
+
+        values = {name: st.secrets.get(name.upper()) for name in cls.model_fields}
+        return cls(**{name: value for name, value in values.items() if value is not None})
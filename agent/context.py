@@ -0,0 +1,99 @@
+from itertools import accumulate
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from agent.profile import conversation_messages, messages_since
+
+# Default prompt budget (in approximate tokens) for the conversation messages of a model call
+DEFAULT_CONTEXT_TOKEN_BUDGET = 3000
+
+
+def get_token_budget(config):
+    """Read the context budget from the config, falling back to the default."""
+    return config["configurable"].get("context_token_budget", DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+def latest_tool_exchange(messages):
+    """Return the latest AI tool call together with its tool results.
+
+    While a review interrupt is pending the tool call has no result yet, so the
+    exchange is just the AI message that raised it.
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        message = messages[index]
+        if isinstance(message, AIMessage) and message.tool_calls:
+            call_ids = {tool_call["id"] for tool_call in message.tool_calls}
+            results = [m for m in messages[index + 1:] if isinstance(m, ToolMessage) and m.tool_call_id in call_ids]
+            return [message] + results
+    return []
+
+
+def split_window(window, budget):
+    """Split the unsummarized `window` into (messages to fold into the summary, messages to keep).
+
+    Nothing is folded while the window fits the budget. Once it doesn't, the
+    oldest turns are folded until the rest fits half the budget, so the summary
+    is only refreshed every few turns. Cuts happen right before a user message,
+    which keeps tool calls next to their results, and never drop the latest one.
+    """
+    token_counts = [count_tokens_approximately([message]) for message in window]
+    if sum(token_counts) <= budget:
+        return [], window
+
+    # suffix_tokens[i] is the size of window[i:]
+    suffix_tokens = list(accumulate(reversed(token_counts)))[::-1]
+    cuts = [index for index, message in enumerate(window) if index > 0 and isinstance(message, HumanMessage)]
+    if not cuts:
+        return [], window
+    cut = next((index for index in cuts if suffix_tokens[index] <= budget // 2), cuts[-1])
+    return window[:cut], window[cut:]
+
+
+def build_context(state, budget, summarize):
+    """Select the messages to send to the model for `state` within `budget`.
+
+    `summarize(summary, messages)` returns the summary extended with `messages`;
+    it is only called when older turns have to leave the window.
+
+    Returns the messages to send, the (possibly refreshed) summary, and the state
+    update to store the summary with.
+    """
+    summary = state.get("summary", "")
+    folded, window = split_state(state, budget)
+    if folded:
+        summary = summarize(summary, conversation_messages(folded))
+    return finish_context(state["messages"], window, summary, folded)
+
+
+async def abuild_context(state, budget, asummarize):
+    """Async version of `build_context`, with `asummarize` a coroutine function."""
+    summary = state.get("summary", "")
+    folded, window = split_state(state, budget)
+    if folded:
+        summary = await asummarize(summary, conversation_messages(folded))
+    return finish_context(state["messages"], window, summary, folded)
+
+
+def split_state(state, budget):
+    """Split the messages not yet in the summary into (to fold, to keep)."""
+    return split_window(messages_since(state["messages"], state.get("summary_watermark")), budget)
+
+
+def finish_context(messages, window, summary, folded):
+    update = {"summary": summary, "summary_watermark": folded[-1].id} if folded else {}
+
+    # The latest tool exchange (the last plan, or the call waiting on the review interrupt)
+    # stays verbatim even once it's been folded into the summary
+    kept_ids = {message.id for message in window}
+    pinned = [message for message in latest_tool_exchange(messages) if message.id not in kept_ids]
+    return pinned + window, summary, update
+
+
+def latest_within_budget(messages, budget):
+    """Return the longest suffix of `messages` that fits `budget` (at least the last message)."""
+    total = 0
+    for index in range(len(messages) - 1, -1, -1):
+        total += count_tokens_approximately([messages[index]])
+        if total > budget:
+            return messages[max(index + 1, len(messages) - 1):]
+    return messages
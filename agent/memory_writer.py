@@ -0,0 +1,96 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryWriter:
+    """Run memory extraction in the background so replies never wait on it.
+
+    Jobs are keyed by user and thread:
+        - a user has at most one extraction running at a time, so writes to the
+          user's profile happen in submission order;
+        - a job waits `debounce` seconds before it starts, and every new turn of
+          the thread restarts the wait (back-to-back turns produce a single extraction);
+        - a newer job replaces the one still waiting for the same thread, so only
+          the latest state of a thread is ever extracted; jobs of the user's other
+          threads are kept, since each thread has its own extraction watermark.
+    """
+
+    def __init__(self, extract, store, max_workers=4, debounce=2.0):
+        self._extract = extract
+        self._store = store
+        self._debounce = debounce
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="memory-writer")
+        self._condition = threading.Condition()
+        self._pending = {}   # (user_id, thread_id) -> (due time, state, config)
+        self._running = set()  # user IDs
+        self._dispatcher = None
+        self._closed = False
+
+    def submit(self, state, config):
+        """Schedule an extraction of `state` for the user in `config`."""
+        job = (config["configurable"]["user_id"], config["configurable"]["thread_id"])
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("MemoryWriter is closed")
+            # Re-inserted, so a user's jobs stay in the order of their latest turn
+            self._pending.pop(job, None)
+            self._pending[job] = (time.monotonic() + self._debounce, state, config)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="memory-writer-dispatch", daemon=True)
+                self._dispatcher.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Start every pending extraction now and wait until the store has settled.
+
+        Returns False if `timeout` (seconds) expired before all jobs finished.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            now = time.monotonic()
+            self._pending = {job: (now, state, config) for job, (_, state, config) in self._pending.items()}
+            self._condition.notify_all()
+            while self._pending or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(timeout=remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Flush pending jobs and stop the worker pool."""
+        settled = self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._executor.shutdown(wait=settled)
+        return settled
+
+    def _dispatch(self):
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                for job, (due, state, config) in list(self._pending.items()):
+                    user_id = job[0]
+                    if due <= now and user_id not in self._running:
+                        del self._pending[job]
+                        self._running.add(user_id)
+                        self._executor.submit(self._run, user_id, state, config)
+
+                # Sleep until the next debounce window closes or a job is submitted/finished
+                waits = [due - now for (user_id, _), (due, _, _) in self._pending.items() if user_id not in self._running]
+                self._condition.wait(timeout=min(waits) if waits else None)
+
+    def _run(self, user_id, state, config):
+        try:
+            self._extract(state, config, self._store)
+        except Exception:
+            logger.exception("Memory extraction failed for user %s", user_id)
+        finally:
+            with self._condition:
+                self._running.discard(user_id)
+                self._condition.notify_all()
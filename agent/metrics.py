@@ -0,0 +1,349 @@
+"""Per-turn traces and process-wide metrics of the agent.
+
+A `TurnTrace` follows one turn (or one background memory extraction): wall
+time, model tokens and cache lookups per step, where the steps are the graph
+nodes plus the work around the graph (interrupt lookup, retention, PDF), and
+the latency of every checkpoint/store operation. Finished traces are logged as
+one JSON line. Everything is also added to `REGISTRY`, which renders the
+metrics in the Prometheus text format (`render`, `dump` or `serve`).
+"""
+import json
+import time
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages.utils import count_tokens_approximately
+
+logger = logging.getLogger(__name__)
+
+# Timed methods of the checkpointer and the store (the other methods go through these)
+CHECKPOINT_OPERATIONS = ("get_tuple", "put", "put_writes", "aget_tuple", "aput", "aput_writes")
+STORE_OPERATIONS = ("get", "put", "search", "list_namespaces", "batch",
+                    "aget", "aput", "asearch", "alist_namespaces", "abatch")
+STORAGE_OPERATIONS = {"checkpoint": CHECKPOINT_OPERATIONS, "store": STORE_OPERATIONS}
+
+
+class Registry:
+    """Thread-safe counters and summaries (count and sum), by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._summaries = defaultdict(lambda: [0, 0.0])
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, _label_key(labels))] += value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            summary = self._summaries[(name, _label_key(labels))]
+            summary[0] += 1
+            summary[1] += value
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            summaries = sorted((key, tuple(value)) for key, value in self._summaries.items())
+
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), (count, total) in summaries:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} summary")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+# Shared by every session of the process
+REGISTRY = Registry()
+
+# The trace of the turn running in the current context (threads and tasks started by the graph inherit it)
+_current_trace = ContextVar("saveup_current_trace", default=None)
+# Set while a storage call is timed, so the calls it makes internally are not counted twice
+_in_storage_call = ContextVar("saveup_in_storage_call", default=False)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+class TurnTrace(BaseCallbackHandler):
+    """Breakdown of one turn, collected from the graph callbacks and the instrumented code.
+
+    Pass it in the callbacks of the run and make it current with `activate` (or
+    `activated` for a generator) so caches and storage report to it too.
+    """
+
+    # Timings are taken when the events happen, even on the async path
+    run_inline = True
+
+    def __init__(self, kind="turn", thread_id=None, user_id=None, default_step=None):
+        self.kind = kind
+        self.thread_id = thread_id
+        self.user_id = user_id
+        self.default_step = default_step or kind
+        self.seconds = None
+        self.steps = {}
+        self.storage = {}
+        self._started = time.perf_counter()
+        self._open = []
+        self._node_runs = {}  # run_id -> (node, start)
+        self._llm_runs = {}   # run_id -> (step, approximate prompt tokens)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def activated(self, iterable):
+        """Iterate `iterable` with the trace current only while it produces the next item."""
+        iterator = iter(iterable)
+        while True:
+            with self.activate():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def finish(self):
+        """Close the trace, log it and add it to the registry; returns the summary."""
+        self.seconds = time.perf_counter() - self._started
+        REGISTRY.inc("saveup_turns_total", kind=self.kind)
+        REGISTRY.observe("saveup_turn_seconds", self.seconds, kind=self.kind)
+        summary = self.summary()
+        logger.info(json.dumps(summary))
+        return summary
+
+    def summary(self):
+        with self._lock:
+            return {"kind": self.kind, "thread_id": self.thread_id, "user_id": self.user_id,
+                    "seconds": self.seconds,
+                    "steps": {step: dict(values) for step, values in self.steps.items()},
+                    "storage": {operation: dict(values) for operation, values in self.storage.items()}}
+
+    def current_step(self):
+        with self._lock:
+            return self._open[-1] if self._open else self.default_step
+
+    def begin_step(self, step):
+        with self._lock:
+            self._open.append(step)
+
+    def end_step(self, step, seconds):
+        with self._lock:
+            if step in self._open:
+                self._open.remove(step)
+            values = self._step(step)
+            values["calls"] += 1
+            values["seconds"] += seconds
+
+    def add_tokens(self, step, prompt_tokens, completion_tokens):
+        REGISTRY.inc("saveup_llm_tokens_total", prompt_tokens, step=step, type="prompt")
+        REGISTRY.inc("saveup_llm_tokens_total", completion_tokens, step=step, type="completion")
+        with self._lock:
+            values = self._step(step)
+            values["prompt_tokens"] += prompt_tokens
+            values["completion_tokens"] += completion_tokens
+
+    def add_cache_lookup(self, hit):
+        step = self.current_step()
+        with self._lock:
+            self._step(step)["cache_hits" if hit else "cache_misses"] += 1
+
+    def add_storage(self, operation, seconds):
+        with self._lock:
+            values = self.storage.setdefault(operation, {"calls": 0, "seconds": 0.0})
+            values["calls"] += 1
+            values["seconds"] += seconds
+
+    def _step(self, step):
+        return self.steps.setdefault(step, {"calls": 0, "seconds": 0.0, "prompt_tokens": 0,
+                                            "completion_tokens": 0, "cache_hits": 0, "cache_misses": 0})
+
+    # Graph nodes
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # Only the node runnable itself, not the chains running inside it
+        if node and kwargs.get("name") == node:
+            self._node_runs[run_id] = (node, time.perf_counter())
+            self.begin_step(node)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_node(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # The review interrupt ends the tools node with an error
+        self._end_node(run_id)
+
+    def _end_node(self, run_id):
+        started = self._node_runs.pop(run_id, None)
+        if started is not None:
+            node, start = started
+            seconds = time.perf_counter() - start
+            REGISTRY.observe("saveup_step_seconds", seconds, step=node)
+            self.end_step(node, seconds)
+
+    # Model calls
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        step = (metadata or {}).get("langgraph_node") or self.current_step()
+        self._llm_runs[run_id] = (step, count_tokens_approximately(messages[0]))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        step, prompt_tokens = self._llm_runs.pop(run_id, (self.current_step(), 0))
+        completion_tokens, usage = 0, None
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is not None:
+                    usage = getattr(message, "usage_metadata", None) or usage
+                    completion_tokens += count_tokens_approximately([message])
+        # The provider's counts win over the approximation when the model reports them
+        if usage:
+            prompt_tokens, completion_tokens = usage["input_tokens"], usage["output_tokens"]
+        self.add_tokens(step, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        step, prompt_tokens = self._llm_runs.pop(run_id, (self.current_step(), 0))
+        self.add_tokens(step, prompt_tokens, 0)
+
+
+@contextmanager
+def timed(step):
+    """Time a step outside the graph, for the current trace and the registry."""
+    trace = current_trace()
+    if trace is not None:
+        trace.begin_step(step)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        REGISTRY.observe("saveup_step_seconds", seconds, step=step)
+        if trace is not None:
+            trace.end_step(step, seconds)
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup, attributed to the running step of the current trace."""
+    REGISTRY.inc("saveup_cache_lookups_total", cache=cache, result="hit" if hit else "miss")
+    trace = current_trace()
+    if trace is not None:
+        trace.add_cache_lookup(hit)
+
+
+@functools.cache
+def instrumented(cls, kind):
+    """Subclass of a checkpointer or store class that times its operations.
+
+    `kind` is "checkpoint" or "store" (see STORAGE_OPERATIONS). A subclass rather
+    than patched instances, since some backends (InMemoryStore) use `__slots__`.
+    """
+    methods = {}
+    for name in STORAGE_OPERATIONS[kind]:
+        method = getattr(cls, name, None)
+        if method is None:
+            continue
+        wrap = _timed_async if asyncio.iscoroutinefunction(method) else _timed_sync
+        methods[name] = wrap(method, kind, name)
+    return type(f"Timed{cls.__name__}", (cls,), methods)
+
+
+def _record_storage(kind, operation, seconds):
+    REGISTRY.observe("saveup_storage_seconds", seconds, kind=kind, operation=operation)
+    trace = current_trace()
+    if trace is not None:
+        trace.add_storage(f"{kind}.{operation}", seconds)
+
+
+def _timed_sync(method, kind, operation):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _in_storage_call.get():
+            return method(*args, **kwargs)
+        token = _in_storage_call.set(True)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _in_storage_call.reset(token)
+            _record_storage(kind, operation, time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_async(method, kind, operation):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if _in_storage_call.get():
+            return await method(*args, **kwargs)
+        token = _in_storage_call.set(True)
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            _in_storage_call.reset(token)
+            _record_storage(kind, operation, time.perf_counter() - start)
+    return wrapper
+
+
+def dump(path):
+    """Write the registry to `path` in the Prometheus text format."""
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(REGISTRY.render())
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve the registry at http://host:port/metrics from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
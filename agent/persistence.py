@@ -0,0 +1,375 @@
+import os
+import abc
+import time
+import asyncio
+import json
+import zlib
+import sqlite3
+import logging
+import threading
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.store.memory import InMemoryStore
+from agent.sharded_store import ShardedStore, check_quota, item_size
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints kept per thread (and per checkpoint namespace) after compaction
+DEFAULT_KEEP_CHECKPOINTS = 20
+# Threads without activity for this long (seconds) are deleted
+DEFAULT_IDLE_TTL = 7 * 24 * 3600
+# Minimum time (seconds) between two idle-thread sweeps
+EVICTION_INTERVAL = 600
+# Lock files the store keys are spread over (see `SqliteKeyLocks`)
+KEY_LOCK_STRIPES = 64
+
+
+class Persistence(abc.ABC):
+    """Checkpointer and store used by the graph, plus retention for the checkpointer.
+
+    After every turn `after_turn` records the thread's activity, drops the
+    thread's checkpoints beyond the last `keep_checkpoints`, and from time to
+    time deletes threads idle for more than `idle_ttl` seconds.
+    """
+
+    def __init__(self, checkpointer, store, keep_checkpoints=DEFAULT_KEEP_CHECKPOINTS, idle_ttl=DEFAULT_IDLE_TTL):
+        self.checkpointer = checkpointer
+        self.store = store
+        self.keep_checkpoints = keep_checkpoints
+        self.idle_ttl = idle_ttl
+        self._last_sweep = time.time()
+
+    def after_turn(self, thread_id):
+        now = time.time()
+        self.touch(thread_id, now)
+        self.compact(thread_id)
+        if now - self._last_sweep >= EVICTION_INTERVAL:
+            self._last_sweep = now
+            evicted = self.evict_idle(now)
+            if evicted:
+                logger.info("Evicted %d idle threads", len(evicted))
+
+    def evict_idle(self, now=None):
+        """Delete every thread idle for longer than `idle_ttl` and return their IDs."""
+        now = time.time() if now is None else now
+        evicted = self.idle_threads(now - self.idle_ttl)
+        for thread_id in evicted:
+            self.checkpointer.delete_thread(thread_id)
+            self.forget(thread_id)
+        return evicted
+
+    def close(self):
+        """Release the connections of the backends."""
+
+    @abc.abstractmethod
+    def touch(self, thread_id, now):
+        """Record activity on a thread."""
+
+    @abc.abstractmethod
+    def compact(self, thread_id):
+        """Drop the thread's checkpoints beyond the last `keep_checkpoints`."""
+
+    @abc.abstractmethod
+    def idle_threads(self, before):
+        """IDs of the threads without activity since `before`."""
+
+    @abc.abstractmethod
+    def forget(self, thread_id):
+        """Drop the activity record of a deleted thread."""
+
+
+def _same_class(cls, kind):
+    return cls
+
+
+class MemoryPersistence(Persistence):
+    """Process-local MemorySaver and one InMemoryStore per user, bounded by the retention settings.
+
+    `instrument(cls, kind)` returns the class to build the checkpointer ("checkpoint")
+    and the store ("store") from, e.g. `metrics.instrumented`.
+    """
+
+    def __init__(self, store_limits=None, instrument=_same_class, **kwargs):
+        store = instrument(ShardedStore, "store")(lambda user_id: InMemoryStore(), **(store_limits or {}))
+        super().__init__(instrument(MemorySaver, "checkpoint")(), store, **kwargs)
+        self._lock = threading.Lock()
+        self._last_activity = {}
+
+    def touch(self, thread_id, now):
+        with self._lock:
+            self._last_activity[thread_id] = now
+
+    def compact(self, thread_id):
+        saver = self.checkpointer
+        with self._lock:
+            for checkpoint_ns, checkpoints in list(saver.storage.get(thread_id, {}).items()):
+                # Let a few extra checkpoints pile up so the blob scan below doesn't run every turn
+                if len(checkpoints) <= 2 * self.keep_checkpoints:
+                    continue
+                for checkpoint_id in sorted(checkpoints)[:-self.keep_checkpoints]:
+                    del checkpoints[checkpoint_id]
+                    saver.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+                # Channel values are stored once per version; drop the versions no kept checkpoint uses
+                live_versions = set()
+                for checkpoint, _, _ in checkpoints.values():
+                    live_versions.update(saver.serde.loads_typed(checkpoint)["channel_versions"].items())
+                stale_blobs = [key for key in list(saver.blobs)
+                               if key[:2] == (thread_id, checkpoint_ns) and key[2:] not in live_versions]
+                for key in stale_blobs:
+                    del saver.blobs[key]
+
+    def idle_threads(self, before):
+        with self._lock:
+            return [thread_id for thread_id, last_seen in self._last_activity.items() if last_seen < before]
+
+    def forget(self, thread_id):
+        with self._lock:
+            self._last_activity.pop(thread_id, None)
+
+
+class SqlitePersistence(Persistence):
+    """SqliteSaver/SqliteStore in a single database file, shareable between processes."""
+
+    def __init__(self, path, store_limits=None, instrument=_same_class, **kwargs):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        saver_class, store_class = threaded_sqlite_classes()
+        self._connections = [connect_sqlite(path), connect_sqlite(path)]
+        checkpointer = instrument(saver_class, "checkpoint")(self._connections[0])
+        checkpointer.setup()
+        sqlite_store = store_class(self._connections[1])
+        sqlite_store.setup()
+        self._key_locks = SqliteKeyLocks(path + ".locks")
+        # Users share the database, which keeps their usage; the shards only hold their key locks
+        store = instrument(ShardedStore, "store")(lambda user_id: sqlite_store, shared=True,
+                                                  process_lock=self._key_locks, **(store_limits or {}))
+        super().__init__(checkpointer, store, **kwargs)
+
+        with self.checkpointer.cursor() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._key_locks.close()
+
+    def touch(self, thread_id, now):
+        with self.checkpointer.cursor() as cursor:
+            cursor.execute("INSERT INTO thread_activity (thread_id, last_seen) VALUES (?, ?) "
+                           "ON CONFLICT(thread_id) DO UPDATE SET last_seen = excluded.last_seen", (thread_id, now))
+
+    def compact(self, thread_id):
+        with self.checkpointer.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id IN (
+                    SELECT checkpoint_id FROM (
+                        SELECT checkpoint_id, ROW_NUMBER() OVER (PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS position
+                        FROM checkpoints WHERE thread_id = ?
+                    ) WHERE position > ?
+                )""", (thread_id, thread_id, self.keep_checkpoints))
+            cursor.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_id NOT IN "
+                           "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ?)", (thread_id, thread_id))
+
+    def idle_threads(self, before):
+        with self.checkpointer.cursor(transaction=False) as cursor:
+            cursor.execute("SELECT thread_id FROM thread_activity WHERE last_seen < ?", (before,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def forget(self, thread_id):
+        with self.checkpointer.cursor() as cursor:
+            cursor.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+
+
+class SqliteLock:
+    """Reentrant lock shared by every process using a database file.
+
+    Held as an IMMEDIATE transaction on a separate lock file, which only one
+    connection at a time can start; the database itself stays free for the
+    store's own transactions.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+            except Exception:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+        finally:
+            self._lock.release()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SqliteKeyLocks:
+    """Locks of the store keys shared by every process using a database, by (namespace, key).
+
+    The keys are spread over `stripes` lock files, so updates of different keys
+    rarely wait on each other and the number of files stays bounded.
+    """
+
+    def __init__(self, directory, stripes=KEY_LOCK_STRIPES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.stripes = stripes
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, namespace, key):
+        # crc32 rather than hash(), which differs between processes
+        stripe = zlib.crc32(repr((tuple(namespace), key)).encode("utf-8")) % self.stripes
+        with self._lock:
+            if stripe not in self._locks:
+                self._locks[stripe] = SqliteLock(os.path.join(self.directory, f"{stripe}.lock"))
+            return self._locks[stripe]
+
+    def close(self):
+        with self._lock:
+            for lock in self._locks.values():
+                lock.close()
+            self._locks.clear()
+
+
+def threaded_sqlite_classes():
+    """SqliteSaver and SqliteStore with their async methods run in a worker thread.
+
+    The SQLite backends only implement the sync API; this lets the async graph
+    (`ainvoke`) use them without blocking the event loop. The store also keeps the
+    usage of every user in the transactions of its puts (`put_within_quota`).
+    """
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    from langgraph.store.sqlite import SqliteStore
+
+    class ThreadedSqliteSaver(SqliteSaver):
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, **kwargs):
+            for checkpoint_tuple in await asyncio.to_thread(lambda: list(self.list(config, **kwargs))):
+                yield checkpoint_tuple
+
+        async def aput(self, *args, **kwargs):
+            return await asyncio.to_thread(self.put, *args, **kwargs)
+
+        async def aput_writes(self, *args, **kwargs):
+            return await asyncio.to_thread(self.put_writes, *args, **kwargs)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    class ThreadedSqliteStore(SqliteStore):
+        """SqliteStore that also keeps the items and bytes of every user, for `ShardedStore` quotas."""
+
+        def setup(self):
+            super().setup()
+            with self.lock:
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'store_usage'").fetchone()
+                    if not exists:
+                        self.conn.execute("CREATE TABLE store_item_usage (prefix TEXT NOT NULL, key TEXT NOT NULL, "
+                                          "bytes INTEGER NOT NULL, PRIMARY KEY (prefix, key))")
+                        self.conn.execute("CREATE TABLE store_usage (user_id TEXT PRIMARY KEY, "
+                                          "items INTEGER NOT NULL, bytes INTEGER NOT NULL)")
+                        # Items written before the usage was kept
+                        for prefix, key, value in self.conn.execute("SELECT prefix, key, value FROM store").fetchall():
+                            self._add_usage(self.conn, prefix, key, item_size(json.loads(value)))
+                    self.conn.execute("COMMIT")
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+
+        def usage(self, user_id):
+            with self._cursor(transaction=False) as cursor:
+                return self._usage_row(cursor, user_id)
+
+        def put_within_quota(self, op, size, max_items, max_bytes):
+            """Run a put (of `size` bytes) or delete (`size` None) and update its user's usage in one transaction.
+
+            Raises StoreQuotaExceeded, and writes nothing, if the user would go over
+            `max_items` items or `max_bytes` bytes.
+            """
+            prefix = ".".join(op.namespace)
+            with self._cursor(transaction=False) as cursor:
+                # IMMEDIATE: no other process writes between the usage check and the put
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    row = cursor.execute("SELECT bytes FROM store_item_usage WHERE prefix = ? AND key = ?",
+                                         (prefix, op.key)).fetchone()
+                    if size is not None:
+                        items, total = self._usage_row(cursor, op.namespace[0])
+                        check_quota(op.namespace[0], items + (row is None), total - (row[0] if row else 0) + size,
+                                    max_items, max_bytes)
+                    self._batch_put_ops([(0, op)], cursor)
+                    if row is not None:
+                        self._remove_usage(cursor, prefix, op.key, row[0])
+                    if size is not None:
+                        self._add_usage(cursor, prefix, op.key, size)
+                    cursor.execute("COMMIT")
+                except BaseException:
+                    cursor.execute("ROLLBACK")
+                    raise
+            return None
+
+        @staticmethod
+        def _usage_row(cursor, user_id):
+            row = cursor.execute("SELECT items, bytes FROM store_usage WHERE user_id = ?", (user_id,)).fetchone()
+            return tuple(row) if row else (0, 0)
+
+        @staticmethod
+        def _add_usage(cursor, prefix, key, size):
+            cursor.execute("INSERT INTO store_item_usage (prefix, key, bytes) VALUES (?, ?, ?)", (prefix, key, size))
+            # The store joins the namespace with dots, so the user is its first part
+            cursor.execute("INSERT INTO store_usage (user_id, items, bytes) VALUES (?, 1, ?) ON CONFLICT(user_id) "
+                           "DO UPDATE SET items = items + 1, bytes = bytes + excluded.bytes", (prefix.split(".")[0], size))
+
+        @staticmethod
+        def _remove_usage(cursor, prefix, key, size):
+            cursor.execute("DELETE FROM store_item_usage WHERE prefix = ? AND key = ?", (prefix, key))
+            cursor.execute("UPDATE store_usage SET items = items - 1, bytes = bytes - ? WHERE user_id = ?",
+                           (size, prefix.split(".")[0]))
+
+        async def abatch(self, ops):
+            return await asyncio.to_thread(self.batch, list(ops))
+
+    return ThreadedSqliteSaver, ThreadedSqliteStore
+
+
+def connect_sqlite(path):
+    """Open a connection in WAL mode so several processes can read while one writes.
+
+    The connection is in autocommit mode (like `SqliteStore.from_conn_string`): with
+    sqlite3's implicit transactions a statement left uncommitted by `setup()`
+    would hold the write lock and block the other connection.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def build_persistence(backend="memory", sqlite_path="data/saveup.sqlite", **kwargs):
+    """Create the persistence layer for `backend` ("memory" or "sqlite")."""
+    if backend == "memory":
+        return MemoryPersistence(**kwargs)
+    if backend == "sqlite":
+        return SqlitePersistence(sqlite_path, **kwargs)
+    raise ValueError(f"Unknown persistence backend: {backend}")
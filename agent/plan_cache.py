@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from agent.metrics import record_cache
+from agent.planner import to_amount, to_months
+from agent.profile import canonical_financial_information
+
+# Keys of the financial information that are parsed before hashing
+PROFILE_FIELDS = ("financial_goal", "goal_amount", "savings", "time_period", "monthly_expenses", "salary")
+
+
+def normalize_financial_information(financial_information):
+    """Canonical form of the financial information: same meaning, same value.
+
+    The profile fields are parsed, other keys are kept as they are: the prompt
+    shows them too, so they tell plans apart.
+    """
+    financial_information = canonical_financial_information(financial_information)
+    goal = financial_information.get("financial_goal")
+    months = to_months(financial_information.get("time_period"))
+    normalized = {
+        "financial_goal": " ".join(str(goal).lower().split()) if goal is not None else None,
+        "time_period_months": round(months, 2) if months is not None else None,
+    }
+    for key in ("goal_amount", "savings", "monthly_expenses", "salary"):
+        amount = to_amount(financial_information.get(key))
+        normalized[key] = round(amount, 2) if amount is not None else None
+    normalized["other"] = {key: value for key, value in financial_information.items()
+                           if key not in PROFILE_FIELDS}
+    return normalized
+
+
+def plan_cache_key(financial_information, prompt_version, model_name):
+    """Content hash of the normalized financial information, the prompt version and the model."""
+    payload = json.dumps({"financial_information": normalize_financial_information(financial_information),
+                          "prompt_version": prompt_version,
+                          "model": model_name}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """Generated financial plans by `plan_cache_key`.
+
+    Plans are kept in an in-memory LRU of `max_entries`. When `directory` is set
+    they are also written there as JSON files, and the least recently used files
+    are removed once the directory holds more than `max_disk_bytes`.
+    """
+
+    def __init__(self, max_entries=256, directory=None, max_disk_bytes=50 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(os.path.getsize(path) for path in self._disk_files())
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._entries:
+                return True
+        return bool(self.directory) and os.path.exists(self._path(key))
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache("plan", True)
+                return self._entries[key]
+
+        plan = self._read_disk(key)
+        with self._lock:
+            if plan is None:
+                self.misses += 1
+                record_cache("plan", False)
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            record_cache("plan", True)
+            self._remember(key, plan)
+            return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            self._remember(key, plan)
+        if self.directory:
+            self._write_disk(key, plan)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "entries": len(self._entries), "disk_bytes": self._disk_bytes}
+
+    def _remember(self, key, plan):
+        self._entries[key] = plan
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _disk_files(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".json")]
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as file:
+                plan = json.load(file)
+            # The modification time doubles as the last access time for eviction
+            os.utime(self._path(key))
+            return plan
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, plan):
+        path = self._path(key)
+        data = json.dumps(plan).encode("utf-8")
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            # Write to a temporary file first so readers never see a partial plan
+            descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temporary, path)
+            self._disk_bytes += len(data) - previous
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        for path in self._disk_files():
+            try:
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                continue
+        self._disk_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
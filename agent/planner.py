@@ -0,0 +1,121 @@
+import re
+import math
+import numpy as np
+
+# Months of expenses an emergency fund should cover
+EMERGENCY_FUND_MONTHS = 3
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+# A number with thousands separated by commas or spaces ("1,200", "3 000") or a decimal comma ("1,5"),
+# and its magnitude suffix
+_AMOUNT = re.compile(r"(?:(?P<grouped>-?\d{1,3}(?:[ ,]\d{3})+(?:\.\d+)?)|(?P<plain>-?\d+(?:[.,]\d+)?))"
+                     r"\s*(?P<magnitude>k|thousand|m|mn|million|b|bn|billion)?\b", re.IGNORECASE)
+_MAGNITUDES = {"k": 1e3, "thousand": 1e3, "m": 1e6, "mn": 1e6, "million": 1e6, "b": 1e9, "bn": 1e9, "billion": 1e9}
+_UNIT_MONTHS = {"day": 1 / 30.4375, "week": 12 / 52, "month": 1, "year": 12}
+_WORD_NUMBERS = {"half a": 0.5, "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+                 "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12}
+_PERIOD = re.compile(r"\b(\d+(?:\.\d+)?|" + "|".join(_WORD_NUMBERS) + r")\s*(day|week|month|year)s?\b")
+
+
+def to_amount(value):
+    """Read an amount like 400, "$1,200.50", "USD 3 000", "1.2k" or "2.5 million" as a float (None if there is none)."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _AMOUNT.search(str(value))
+    if not match:
+        return None
+    if match["grouped"]:
+        number = float(re.sub(r"[ ,]", "", match["grouped"]))
+    else:
+        number = float(match["plain"].replace(",", "."))
+    return number * _MAGNITUDES.get((match["magnitude"] or "").lower(), 1)
+
+
+def to_months(time_period):
+    """Read a time period like 5, "5 months", "2 years" or "a year" as a number of months."""
+    if time_period is None or isinstance(time_period, bool):
+        return None
+    if isinstance(time_period, (int, float)):
+        return float(time_period)
+    text = str(time_period).lower().replace(",", "")
+    # "1 year and 6 months" adds up every amount with its unit
+    periods = _PERIOD.findall(text)
+    if periods:
+        return sum((_WORD_NUMBERS[count] if count in _WORD_NUMBERS else float(count)) * _UNIT_MONTHS[unit]
+                   for count, unit in periods)
+    # A bare number is read as months
+    match = _NUMBER.search(text)
+    return float(match.group()) if match else None
+
+
+def compute_plan_figures(financial_information):
+    """Compute the numbers of a financial plan from the user's financial information.
+
+    Returns None when goal amount, savings, time period, monthly expenses or salary is
+    missing or not positive enough to plan with: unknown savings are not taken as 0.
+    The keys are the profile fields (see `profile.canonical_financial_information`).
+    Amounts are monthly and rounded to cents.
+    """
+    goal_amount = to_amount(financial_information.get("goal_amount"))
+    savings = to_amount(financial_information.get("savings"))
+    months = to_months(financial_information.get("time_period"))
+    monthly_expenses = to_amount(financial_information.get("monthly_expenses"))
+    salary = to_amount(financial_information.get("salary"))
+    if goal_amount is None or savings is None or monthly_expenses is None or not months or not salary:
+        return None
+
+    months = max(1, math.ceil(months))
+    monthly_surplus = salary - monthly_expenses
+    gap_to_goal = max(goal_amount - savings, 0.0)
+    required_monthly_savings = gap_to_goal / months
+
+    # Month-by-month balance when saving exactly the required amount, and when saving the whole surplus
+    month = np.arange(1, months + 1)
+    required_balance = savings + required_monthly_savings * month
+    surplus_balance = savings + max(monthly_surplus, 0.0) * month
+
+    return {
+        "months": months,
+        "monthly_surplus": round(monthly_surplus, 2),
+        "gap_to_goal": round(gap_to_goal, 2),
+        "required_monthly_savings": round(required_monthly_savings, 2),
+        "required_savings_rate": round(required_monthly_savings / salary, 4),
+        "share_of_surplus": round(required_monthly_savings / monthly_surplus, 4) if monthly_surplus > 0 else None,
+        # Savings that already cover the goal are feasible whatever the surplus
+        "feasible": gap_to_goal == 0 or required_monthly_savings <= monthly_surplus,
+        "months_to_goal_at_surplus": (0 if gap_to_goal == 0 else math.ceil(gap_to_goal / monthly_surplus))
+                                     if monthly_surplus > 0 else None,
+        "emergency_fund_target": round(EMERGENCY_FUND_MONTHS * monthly_expenses, 2),
+        "projection": [{"month": int(m), "balance_at_required_savings": round(float(r), 2),
+                        "balance_saving_full_surplus": round(float(s), 2)}
+                       for m, r, s in zip(month, required_balance, surplus_balance)],
+    }
+
+
+def format_plan_figures(figures):
+    """Render the computed figures for the plan generation prompt."""
+    if figures is None:
+        return "Not enough information to compute exact figures."
+
+    months_to_goal = figures["months_to_goal_at_surplus"]
+    share_of_surplus = figures["share_of_surplus"]
+    lines = [
+        f"- Time period: {figures['months']} months",
+        f"- Monthly surplus (salary - monthly expenses): ${figures['monthly_surplus']:,.2f}",
+        f"- Gap to goal (goal amount - savings): ${figures['gap_to_goal']:,.2f}",
+        f"- Required monthly savings: ${figures['required_monthly_savings']:,.2f}",
+        f"- Required savings rate: {figures['required_savings_rate']:.1%} of salary"
+        + (f" ({share_of_surplus:.1%} of the monthly surplus)" if share_of_surplus is not None else ""),
+        f"- Feasible within the time period: {'yes' if figures['feasible'] else 'no'}",
+        f"- Months to goal saving the whole surplus: {months_to_goal if months_to_goal is not None else 'never (no surplus)'}",
+        f"- Emergency fund target ({EMERGENCY_FUND_MONTHS} months of expenses): ${figures['emergency_fund_target']:,.2f}",
+        "- Projected balance at the required savings:",
+    ]
+    # Monthly for short plans, otherwise every year and the final month
+    projection = figures["projection"]
+    if len(projection) > 12:
+        projection = [row for row in projection if row["month"] % 12 == 0 or row["month"] == len(projection)]
+    lines += [f"    month {row['month']}: ${row['balance_at_required_savings']:,.2f}" for row in projection]
+    return "\n".join(lines)
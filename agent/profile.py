@@ -0,0 +1,152 @@
+import re
+from typing import Optional
+from pydantic import BaseModel, Field, ValidationError
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agent.planner import to_amount, to_months
+
+
+class FinancialProfile(BaseModel):
+    """The user's financial information, with the keys `generate_financial_plan` expects."""
+    financial_goal: Optional[str] = Field(None, description="The user's main financial objective (e.g., \"buy a house\").")
+    goal_amount: Optional[float] = Field(None, description="Target amount needed to achieve the goal.")
+    savings: Optional[float] = Field(None, description="Current savings balance.")
+    time_period: Optional[str] = Field(None, description="Time horizon to reach the goal, in months or years (e.g., \"5 months\").")
+    monthly_expenses: Optional[float] = Field(None, description="Average monthly expenses.")
+    salary: Optional[float] = Field(None, description="Monthly income/salary.")
+
+    @classmethod
+    def from_item(cls, item):
+        """Build the profile from a store item (or None if nothing is stored yet)."""
+        if item is None:
+            return cls()
+        value = item.value.get("financial_information")
+        # Profiles written before the structured format were a free-text blob
+        if not isinstance(value, dict):
+            return cls()
+        return cls(**value)
+
+    def merge(self, update: "FinancialProfile") -> "FinancialProfile":
+        """Return a copy where every field set in `update` replaces the current value."""
+        changes = {key: value for key, value in update.model_dump().items() if value is not None}
+        return self.model_copy(update=changes)
+
+    def is_empty(self):
+        return all(value is None for value in self.model_dump().values())
+
+    def to_prompt(self):
+        """Render the profile for a system prompt."""
+        if self.is_empty():
+            return "No existing financial information found."
+        return "\n".join(f"- {key}: {'unknown' if value is None else value}" for key, value in self.model_dump().items())
+
+
+# Profile fields holding an amount of money
+AMOUNT_FIELDS = ("goal_amount", "savings", "monthly_expenses", "salary")
+
+
+# Names the model uses for the profile fields in its tool calls
+FIELD_ALIASES = {
+    "goal": "financial_goal", "target": "financial_goal",
+    "target_amount": "goal_amount", "goal_cost": "goal_amount", "amount": "goal_amount",
+    "current_savings": "savings", "savings_balance": "savings",
+    "timeframe": "time_period", "time_frame": "time_period", "deadline": "time_period",
+    "expenses": "monthly_expenses", "monthly_expense": "monthly_expenses",
+    "income": "salary", "monthly_income": "salary", "monthly_salary": "salary",
+}
+
+
+def canonical_financial_information(financial_information):
+    """Tool-call financial information with the model's aliases renamed to the profile fields.
+
+    A field given under its own name wins over its aliases; other keys are kept
+    as they are.
+    """
+    canonical = {key: value for key, value in financial_information.items() if key not in FIELD_ALIASES}
+    for key, value in financial_information.items():
+        if key in FIELD_ALIASES:
+            field = FIELD_ALIASES[key]
+            # An alias only fills a field that is missing or empty; otherwise it stays an extra key
+            if canonical.get(field) is None:
+                canonical[field] = value
+            else:
+                canonical[key] = value
+    return canonical
+
+
+def validate_edit(changes):
+    """Validate the user's field edits of the reviewed financial information and return them typed.
+
+    An empty value clears the field and amounts are read like "$1,200" (see
+    `to_amount`). Keys the model added to the tool call beyond the profile
+    fields are returned as entered; `edited_profile` leaves them out of the
+    profile. Raises ValueError for an invalid value, with a message meant for the user.
+    """
+    changes = {key: None if isinstance(value, str) and not value.strip() else value for key, value in changes.items()}
+    fields = {key: value for key, value in changes.items() if key in FinancialProfile.model_fields}
+    extra = {key: value for key, value in changes.items() if key not in FinancialProfile.model_fields}
+    for key in AMOUNT_FIELDS:
+        if isinstance(fields.get(key), str):
+            amount = to_amount(fields[key])
+            if amount is None:
+                raise ValueError(f"{_label(key)}: use an amount like \"1200\" or \"$1,200\"")
+            fields[key] = amount
+    try:
+        edited = FinancialProfile.model_validate(fields)
+    except ValidationError as error:
+        problem = error.errors()[0]
+        raise ValueError(f"{_label(problem['loc'][0])}: {problem['msg']}") from None
+    for key in AMOUNT_FIELDS:
+        if getattr(edited, key) is not None and getattr(edited, key) < 0:
+            raise ValueError(f"{_label(key)}: can't be negative")
+    if edited.time_period is not None and to_months(edited.time_period) is None:
+        raise ValueError(f"{_label('time_period')}: use a period like \"6 months\" or \"2 years\"")
+    return {**edited.model_dump(include=set(fields)), **extra}
+
+
+def edited_profile(profile, changes):
+    """Copy of `profile` with the edited profile fields of `changes` (other keys are ignored)."""
+    return profile.model_copy(update={key: value for key, value in changes.items() if key in FinancialProfile.model_fields})
+
+
+def _label(key):
+    return str(key).replace("_", " ").title()
+
+
+# Anything a turn needs to mention to possibly change the profile: a number,
+# a currency, or a word tied to one of the six fields
+PROFILE_HINTS = re.compile(
+    r"\d|[$€£¥]"
+    r"|\b(?:zero|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|twenty|thirty|forty|fifty|hundred|thousand|million|half|dozen|k)\b"
+    r"|\b(?:dollars?|bucks|usd|euros?|eur|pounds?|gbp|pesos?|mxn|cents?|grand)\b"
+    r"|\b(?:goal|buy|purchase|afford|save|saving|savings|saved|salary|income|earn|earns|earning|paid|pay|wage|wages|paycheck"
+    r"|expense|expenses|spend|spending|spent|cost|costs|rent|bills?|budget|debt|loan"
+    r"|trip|vacation|holiday|car|house|home|tv|phone|laptop|wedding|tuition|retire|retirement"
+    r"|day|days|week|weeks|month|months|monthly|year|years|yearly|annual|annually|deadline)\b",
+    re.IGNORECASE,
+)
+
+
+def may_update_profile(messages):
+    """Cheap local check: can any of the user's `messages` change the profile?"""
+    return any(isinstance(message, HumanMessage) and PROFILE_HINTS.search(str(message.content))
+               for message in messages)
+
+
+def messages_since(messages, watermark):
+    """Return the messages after the one whose id is `watermark`.
+
+    If the watermark is unknown (first extraction, or the message is gone) all
+    messages are returned.
+    """
+    if watermark is not None:
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].id == watermark:
+                return messages[index + 1:]
+    return messages
+
+
+def conversation_messages(messages):
+    """Keep the user/assistant exchange only; tool calls and results carry no new user facts."""
+    return [message for message in messages
+            if isinstance(message, HumanMessage) or (isinstance(message, AIMessage) and not message.tool_calls)]
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from agent.planner import to_amount, to_months
+
+# Default variations around the user's own numbers
+DEFAULT_TIME_PERIODS = (3, 6, 9, 12, 18, 24, 36)
+DEFAULT_EXPENSE_DELTAS = (-0.2, -0.1, 0.0, 0.1, 0.2)
+DEFAULT_SALARY_DELTAS = (-0.1, 0.0, 0.1)
+DEFAULT_INTEREST_RATES = (0.0, 0.04)
+DEFAULT_INFLATION_RATES = (0.0, 0.03)
+
+
+def evaluate_scenarios(financial_information, time_periods=None, expense_deltas=DEFAULT_EXPENSE_DELTAS,
+                       salary_deltas=DEFAULT_SALARY_DELTAS, interest_rates=DEFAULT_INTEREST_RATES,
+                       inflation_rates=DEFAULT_INFLATION_RATES):
+    """Evaluate every combination of the given variations of a financial plan in one vectorized pass.
+
+    Parameters:
+        financial_information (dict): The user's data, with the keys of `generate_financial_plan`.
+        time_periods: Months to reach the goal. The user's own time period is always included.
+        expense_deltas / salary_deltas: Relative changes, e.g. 0.1 for +10%.
+        interest_rates: Annual interest earned on savings, compounded monthly.
+        inflation_rates: Annual growth of the goal amount.
+
+    Returns:
+        pd.DataFrame: One row per scenario with the monthly surplus, the required monthly
+        savings, the required savings rate, whether it is feasible and the slack left each month.
+        Empty when the data needed to plan is missing.
+    """
+    goal_amount = to_amount(financial_information.get("goal_amount"))
+    savings = to_amount(financial_information.get("savings")) or 0.0
+    monthly_expenses = to_amount(financial_information.get("monthly_expenses"))
+    salary = to_amount(financial_information.get("salary"))
+    if goal_amount is None or monthly_expenses is None or not salary:
+        return pd.DataFrame()
+
+    user_months = to_months(financial_information.get("time_period"))
+    periods = set(DEFAULT_TIME_PERIODS if time_periods is None else time_periods)
+    if user_months:
+        periods.add(int(np.ceil(user_months)))
+
+    # One axis per variation; broadcasting builds the full grid
+    months, expense_delta, salary_delta, interest, inflation = np.meshgrid(
+        np.array(sorted(periods), dtype=float), np.asarray(expense_deltas, dtype=float),
+        np.asarray(salary_deltas, dtype=float), np.asarray(interest_rates, dtype=float),
+        np.asarray(inflation_rates, dtype=float), indexing="ij", sparse=True)
+
+    monthly_rate = (1 + interest) ** (1 / 12) - 1
+    growth = (1 + monthly_rate) ** months
+    target = goal_amount * (1 + inflation) ** (months / 12)
+    # Future value of saving 1 per month; `months` when savings earn no interest
+    annuity = np.where(monthly_rate > 0, (growth - 1) / np.where(monthly_rate > 0, monthly_rate, 1), months)
+    required = np.maximum(target - savings * growth, 0) / annuity
+
+    adjusted_salary = salary * (1 + salary_delta)
+    surplus = adjusted_salary - monthly_expenses * (1 + expense_delta)
+
+    shape = np.broadcast_shapes(months.shape, expense_delta.shape, salary_delta.shape, interest.shape, inflation.shape)
+    grid = {
+        "months": months, "expense_change": expense_delta, "salary_change": salary_delta,
+        "interest_rate": interest, "inflation_rate": inflation,
+        "monthly_surplus": surplus, "required_monthly_savings": required,
+        "required_savings_rate": required / adjusted_salary, "feasible": required <= surplus,
+        "monthly_slack": surplus - required,
+    }
+    table = pd.DataFrame({name: np.broadcast_to(values, shape).ravel() for name, values in grid.items()})
+    table["months"] = table["months"].astype(int)
+    return table.round({"monthly_surplus": 2, "required_monthly_savings": 2, "required_savings_rate": 4, "monthly_slack": 2})
+
+
+def feasibility_by_period(scenarios):
+    """Summarize a scenario table per time period: share of feasible scenarios and required savings range."""
+    if scenarios.empty:
+        return scenarios
+    return (scenarios.groupby("months")
+            .agg(feasible_share=("feasible", "mean"),
+                 min_required_savings=("required_monthly_savings", "min"),
+                 max_required_savings=("required_monthly_savings", "max"))
+            .round({"feasible_share": 2})
+            .reset_index())
@@ -0,0 +1,161 @@
+import json
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from langgraph.store.base import BaseStore, GetOp, ListNamespacesOp, PutOp, SearchOp
+
+# Defaults of the per-user limits
+DEFAULT_MAX_USERS = 10_000
+DEFAULT_MAX_ITEMS_PER_USER = 500
+DEFAULT_MAX_BYTES_PER_USER = 1024 * 1024
+
+
+class StoreQuotaExceeded(Exception):
+    """A put would take a user over their item or byte quota."""
+
+
+class _Shard:
+    def __init__(self, store):
+        self.store = store
+        self.usage = {}      # (namespace, key) -> bytes of the value (unshared stores only)
+        self.key_locks = {}  # (namespace, key) -> lock of `ShardedStore.lock`
+        self.lock = threading.Lock()
+
+
+class ShardedStore(BaseStore):
+    """Long-term store split into one shard per user, the first element of every namespace.
+
+        - a user holds at most `max_items_per_user` items and `max_bytes_per_user`
+          bytes of values; a put beyond that raises StoreQuotaExceeded;
+        - at most `max_users` shards are kept, the least recently used user is evicted;
+        - `lock(namespace, key)` serializes read-modify-write updates of a key, so
+          concurrent sessions of a user don't overwrite each other's changes.
+
+    `create_shard(user_id)` returns the store of a new shard. With `shared=True`
+    every user lives in the same persistent store (e.g. SQLite), possibly used by
+    several processes: shards only keep the key locks of a user, so evicting them
+    loses no data. The shared store then keeps the usage of every user itself, with
+    `usage(user_id)` and `put_within_quota(op, size, max_items, max_bytes)`, which
+    checks the quota and writes in one transaction (see `persistence.threaded_sqlite_classes`),
+    and `process_lock(namespace, key)` returns the lock of a key shared by those
+    processes, held inside `lock`. Otherwise evicting a user drops their long-term memory.
+    """
+
+    def __init__(self, create_shard, shared=False, process_lock=None, max_users=DEFAULT_MAX_USERS,
+                 max_items_per_user=DEFAULT_MAX_ITEMS_PER_USER, max_bytes_per_user=DEFAULT_MAX_BYTES_PER_USER):
+        self._create_shard = create_shard
+        self.shared = shared
+        self._process_lock = process_lock or (lambda namespace, key: nullcontext())
+        self.max_users = max_users
+        self.max_items_per_user = max_items_per_user
+        self.max_bytes_per_user = max_bytes_per_user
+        self._shards = OrderedDict()  # user_id -> _Shard, least recently used first
+        self._lock = threading.Lock()
+        self._shared_store = create_shard(None) if shared else None
+
+    @contextmanager
+    def lock(self, namespace, key):
+        """Lock one key of a user, to hold around a get followed by a put."""
+        shard = self._shard(namespace[0])
+        with shard.lock:
+            key_lock = shard.key_locks.setdefault((tuple(namespace), key), threading.Lock())
+        with key_lock, self._process_lock(tuple(namespace), key):
+            yield
+
+    def usage(self, user_id):
+        """(items, bytes) stored for a user."""
+        if self.shared:
+            return self._shared_store.usage(user_id)
+        shard = self._shard(user_id)
+        with shard.lock:
+            return len(shard.usage), sum(shard.usage.values())
+
+    def batch(self, ops):
+        return [self._run(op) for op in ops]
+
+    async def abatch(self, ops):
+        return await asyncio.to_thread(self.batch, ops)
+
+    def _run(self, op):
+        if isinstance(op, PutOp):
+            return self._put(op)
+        if isinstance(op, GetOp):
+            return self._shard(op.namespace[0]).store.batch([op])[0]
+        if isinstance(op, SearchOp):
+            if op.namespace_prefix:
+                return self._shard(op.namespace_prefix[0]).store.batch([op])[0]
+            return self._fan_out(op)
+        if isinstance(op, ListNamespacesOp):
+            user_id = _prefix_user(op)
+            if user_id is not None:
+                return self._shard(user_id).store.batch([op])[0]
+            return self._fan_out(op)
+        raise ValueError(f"Unknown store operation: {type(op).__name__}")
+
+    def _put(self, op):
+        if self.shared:
+            # The store checks and updates the user's usage in the transaction of the put
+            size = None if op.value is None else item_size(op.value)
+            return self._shared_store.put_within_quota(op, size, self.max_items_per_user, self.max_bytes_per_user)
+        shard = self._shard(op.namespace[0])
+        item_key = (tuple(op.namespace), op.key)
+        with shard.lock:
+            usage = shard.usage
+            if op.value is None:
+                shard.store.batch([op])
+                usage.pop(item_key, None)
+                return None
+            size = item_size(op.value)
+            check_quota(op.namespace[0], len(usage) + (item_key not in usage),
+                        sum(usage.values()) - usage.get(item_key, 0) + size,
+                        self.max_items_per_user, self.max_bytes_per_user)
+            shard.store.batch([op])
+            usage[item_key] = size
+        return None
+
+    def _fan_out(self, op):
+        """Run a search or namespace listing that isn't limited to one user on every shard."""
+        if self.shared:
+            return self._shared_store.batch([op])[0]
+        with self._lock:
+            stores = [shard.store for shard in self._shards.values()]
+        # Every shard returns its first offset + limit results, the page is cut from all of them
+        widened = op._replace(offset=0, limit=op.offset + op.limit)
+        results = [result for store in stores for result in store.batch([widened])[0]]
+        if isinstance(op, ListNamespacesOp):
+            results = sorted(results)
+        return results[op.offset:op.offset + op.limit]
+
+    def _shard(self, user_id):
+        with self._lock:
+            shard = self._shards.get(user_id)
+            if shard is not None:
+                self._shards.move_to_end(user_id)
+                return shard
+            shard = _Shard(self._shared_store if self.shared else self._create_shard(user_id))
+            self._shards[user_id] = shard
+            while len(self._shards) > self.max_users:
+                self._shards.popitem(last=False)
+            return shard
+
+
+def check_quota(user_id, items, size, max_items, max_bytes):
+    """Raise StoreQuotaExceeded if a user would hold more than `max_items` items or `max_bytes` bytes."""
+    if items > max_items:
+        raise StoreQuotaExceeded(f"User {user_id} is over the quota of {max_items} items")
+    if size > max_bytes:
+        raise StoreQuotaExceeded(f"User {user_id} is over the quota of {max_bytes} bytes")
+
+
+def item_size(value):
+    """Bytes of a value counted towards the quota."""
+    return len(json.dumps(value, default=str).encode("utf-8"))
+
+
+def _prefix_user(op):
+    """The user a namespace listing is limited to, if its prefix names one."""
+    for condition in op.match_conditions or ():
+        if condition.match_type == "prefix" and condition.path and condition.path[0] != "*":
+            return condition.path[0]
+    return None
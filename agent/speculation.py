@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PlanSpeculator:
+    """Plans generated in the background while the user reviews the financial information.
+
+    `start` begins generating the plan for a key (at most once per key), `take`
+    hands over the future of an accepted plan and `discard` cancels a declined
+    one. Plans only reach the plan cache once taken, so a declined plan is never
+    reused. At most `max_entries` speculations are kept; the oldest are dropped.
+    """
+
+    def __init__(self, generate, max_entries=64, max_workers=4):
+        self._generate = generate
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plan-speculation")
+        self._futures = OrderedDict()  # key -> future of the plan
+        self._lock = threading.Lock()
+
+    def start(self, key, financial_information):
+        """Start generating the plan for `key` unless it has already been started."""
+        with self._lock:
+            if key in self._futures:
+                self._futures.move_to_end(key)
+                return self._futures[key]
+            future = self._executor.submit(self._generate, financial_information)
+            self._futures[key] = future
+            while len(self._futures) > self.max_entries:
+                _, dropped = self._futures.popitem(last=False)
+                dropped.cancel()
+            return future
+
+    def take(self, key):
+        """Remove and return the future of the plan for `key`, or None if there is none."""
+        with self._lock:
+            future = self._futures.pop(key, None)
+        return None if future is None or future.cancelled() else future
+
+    def discard(self, key):
+        """Forget the plan for `key`; it is cancelled if it hasn't started yet."""
+        with self._lock:
+            future = self._futures.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def close(self):
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+# Threads listed per user; older ones are deleted
+DEFAULT_THREADS_PER_USER = 50
+# Characters of the first user message kept as the thread title
+TITLE_LENGTH = 40
+# Upper bound of a search of one user's index (pruning keeps it far smaller)
+INDEX_SEARCH_LIMIT = 1000
+
+
+def threads_namespace(user_id):
+    return (user_id, "threads")
+
+
+def thread_title(message):
+    """Title of a thread from its first user message."""
+    title = " ".join(str(message).split())
+    return title if len(title) <= TITLE_LENGTH else title[:TITLE_LENGTH - 1].rstrip() + "…"
+
+
+def index_turn(store, user_id, thread_id, message, pending_interrupt):
+    """Record a turn in the user's thread index; returns True if the thread is new.
+
+    Each entry holds the thread's title, creation and last activity times and
+    whether it is waiting on a review interrupt, so the sidebar can list the
+    threads without reading any checkpoint.
+    """
+    namespace = threads_namespace(user_id)
+    item = store.get(namespace, thread_id)
+    now = datetime.now(timezone.utc).isoformat()
+    entry = dict(item.value) if item else {"title": thread_title(message), "created_at": now}
+    entry.update(last_activity=now, pending_interrupt=pending_interrupt)
+    store.put(namespace, thread_id, entry)
+    return item is None
+
+
+def list_threads(store, user_id, limit=None):
+    """The user's threads as dictionaries with an "id", most recently active first."""
+    # The store can't sort by a value, but pruning keeps the index small enough to sort here
+    items = store.search(threads_namespace(user_id), limit=INDEX_SEARCH_LIMIT)
+    threads = sorted(({"id": item.key, **item.value} for item in items),
+                     key=lambda thread: thread["last_activity"], reverse=True)
+    return threads if limit is None else threads[:limit]
+
+
+def prune_threads(store, user_id, keep=DEFAULT_THREADS_PER_USER):
+    """Drop the index entries beyond the `keep` most recent threads and return their IDs."""
+    dropped = [thread["id"] for thread in list_threads(store, user_id)[keep:]]
+    for thread_id in dropped:
+        store.delete(threads_namespace(user_id), thread_id)
+    return dropped
+
+
+def transcript(messages):
+    """The user and assistant messages of a thread, as {"role", "content", "id", "after_tool"} dicts.
+
+    Tool calls and tool results are left out; "after_tool" marks the assistant
+    replies that answer a tool result (a generated plan).
+    """
+    turns, after_tool = [], False
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            turns.append({"role": "user", "content": message.content, "id": message.id, "after_tool": False})
+        elif isinstance(message, ToolMessage):
+            after_tool = True
+        elif isinstance(message, AIMessage) and message.content and not message.tool_calls:
+            turns.append({"role": "assistant", "content": message.content, "id": message.id, "after_tool": after_tool})
+            after_tool = False
+    return turns
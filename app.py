@@ -1,39 +1,192 @@
 import uuid
 import pandas as pd
 import streamlit as st
-from datetime import datetime
-from agent.agent import invoke
-from file_helper import  generate_pdf_bytes
+from agent.agent import get_threads, load_thread, stream
+from agent.scenarios import evaluate_scenarios, feasibility_by_period
+from file_helper import  cache_plan_pdf, get_plan_pdf
+
+# Messages rendered on every rerun; older ones stay collapsed until asked for
+HISTORY_WINDOW = int(st.secrets.get("CHAT_HISTORY_WINDOW", 20))
+
+def chat_message(role, content, metadata=None, message_id=None):
+    # The ID gives the message's widgets stable keys across reruns
+    return {"id": message_id or str(uuid.uuid4()), "role": role, "content": content, "metadata": metadata or {}}
+
+def greeting():
+    return chat_message("assistant", "Hello, How can I help you?")
 
 def update_selection_value(value):
     st.session_state.selection = value
 
+def show_earlier_messages():
+    st.session_state.history_window += HISTORY_WINDOW
 
-filename="out/financial_plan.pdf"
+def submit_edit(message_id, fields):
+    # Resume the review with the edited rows only; without edits it's a plain ACCEPT
+    edited_rows = st.session_state[f"review_{message_id}"]["edited_rows"]
+    changes = {fields[int(row)]: values["Value"] for row, values in edited_rows.items() if "Value" in values}
+    st.session_state.selection = {"type": "edit", "financial_information": changes} if changes else "ACCEPT"
 
+def selection_text(selection):
+    if isinstance(selection, dict):
+        return "Updated " + ", ".join(f"{key.replace('_', ' ').title()}: {value}"
+                                      for key, value in selection["financial_information"].items())
+    return selection
 
-# Sidebar: system message input
-with st.sidebar:
-    st.title("SaveUp")
-    with st.expander("See Chat History"):
+def review_metadata(interruption):
+    return {"financial_information": financial_information_table(interruption["financial_information"]),
+            "review": interruption["financial_information"],
+            "options": interruption["question"]["options"],
+            "error": interruption.get("error")}
 
-        with st.container(horizontal=False, horizontal_alignment="left", gap=None):
-            st.button("New Chat", type="tertiary")
-            st.button("Chat 1", type="tertiary")
-            st.button("Chat 2", type="tertiary")
-            st.button("Chat 3", type="tertiary")
-    st.write("**Agent Graph**")
-    st.image("static/agent.png", caption="Agent Graph")
+def show_review(message_id, metadata):
+    # The values can be fixed in place and submitted, instead of declining and chatting again
+    if metadata.get("error"):
+        st.error(metadata["error"])
+    st.data_editor(metadata["financial_information"], key=f"review_{message_id}", disabled=["Field"],
+                   width="content", hide_index=True)
+    flex = st.container(horizontal=True, horizontal_alignment="left")
+    for option in metadata["options"]:
+        flex.button(option, key=f"option_{message_id}_{option}", on_click=update_selection_value, args=(option,), type="primary")
+    flex.button("Submit changes", key=f"edit_{message_id}", on_click=submit_edit, args=(message_id, list(metadata["review"])))
+
+def show_pdf_download(message_id, pdf_bytes):
+    # Downloading doesn't need a rerun of the app
+    st.download_button( label="⬇️ Download PDF",
+                        key=f"pdf_{message_id}",
+                        data=pdf_bytes,
+                        file_name="financial_plan.pdf",
+                        mime="application/pdf",
+                        on_click="ignore")
+
+def show_message(message, last):
+    with st.chat_message(name=message["role"]):
+        st.markdown(message["content"], unsafe_allow_html=True)
+        metadata = message["metadata"]
+        # The review of a chat that is still waiting on it
+        if "options" in metadata and last and st.session_state.selection is None:
+            show_review(message["id"], metadata)
+        elif "financial_information" in metadata:
+            st.dataframe(metadata["financial_information"], width="content", hide_index=True)
+
+        if "pdf_key" in metadata:
+            # Session state only keeps the key; the bytes live in the shared PDF cache
+            pdf_bytes = get_plan_pdf(metadata["pdf_key"])
+            if pdf_bytes is not None:
+                show_pdf_download(message["id"], pdf_bytes)
+
+def show_chat(messages):
+    # Only the latest messages are rendered; the rest cost nothing until they are shown
+    hidden = max(0, len(messages) - st.session_state.history_window)
+    if hidden:
+        st.button(f"Show {min(hidden, HISTORY_WINDOW)} earlier messages ({hidden} hidden)",
+                  key="show_earlier_messages", type="tertiary", on_click=show_earlier_messages)
+    for index in range(hidden, len(messages)):
+        show_message(messages[index], last=index == len(messages) - 1)
+
+def financial_information_table(financial_information):
+    # Mapping function
+    financial_information = {key.replace("_", " ").title(): str(value) for key, value in financial_information.items()}
+    return pd.DataFrame(list(financial_information.items()), columns=["Field", "Value"])
+
+@st.cache_data(max_entries=256)
+def scenario_summary(financial_information):
+    """The number of what-if scenarios of the financial information and their summary by time period.
+
+    Cached on the financial information, so reruns don't rebuild the scenario grid.
+    Only the summary is kept, not the grid.
+    """
+    scenarios = evaluate_scenarios(financial_information)
+    return len(scenarios), feasibility_by_period(scenarios)
+
+def current_user_id():
+    # Signed-in users (st.login) keep their memory across sessions and devices
+    if getattr(st.user, "is_logged_in", False):
+        return f"user:{st.user.get('sub') or st.user.get('email')}"
+    # Anyone else is a new user for every browser session; the ID never leaves the server
+    if "anonymous_id" not in st.session_state:
+        st.session_state.anonymous_id = f"anon:{uuid.uuid4()}"
+    return st.session_state.anonymous_id
+
+def new_chat():
+    st.session_state.chat_id = str(uuid.uuid4())
+    st.session_state.messages = [greeting()]
+    st.session_state.history_window = HISTORY_WINDOW
+    st.session_state.financial_plan = {}
+    st.session_state.selection = None
+    st.session_state.pop("financial_information", None)
+
+def open_chat(thread_id):
+    # One read of the thread's latest checkpoint rebuilds the whole conversation
+    thread = load_thread(thread_id, st.session_state.user_id)
+    if thread is None:
+        st.toast("This chat is no longer available.")
+        return
+    turns, interruption, financial_plan = thread
+
+    new_chat()
+    st.session_state.chat_id = thread_id
+    messages = [chat_message(turn["role"], turn["content"], message_id=turn["id"]) for turn in turns]
+    if financial_plan:
+        st.session_state.financial_plan = financial_plan
+        # The download goes with the reply to the latest plan
+        replies = [message for message, turn in zip(messages, turns) if turn["after_tool"]]
+        if replies:
+            replies[-1]["metadata"] = {"pdf_key": cache_plan_pdf(financial_plan)}
+    if interruption is not None:
+        st.session_state.financial_information = interruption["financial_information"]
+        messages.append(chat_message("assistant", interruption["question"]["text"], review_metadata(interruption)))
+    st.session_state.messages += messages
 
+@st.fragment
+def turn_metrics_panel():
+    # A fragment: toggling the panel doesn't rerun the chat
+    if st.toggle("Show turn metrics", key="show_turn_metrics") and st.session_state.get("last_turn"):
+        show_turn_metrics(st.session_state.last_turn)
 
-if "user_id" not in st.session_state:
-    st.session_state.user_id = "001"  
+def show_chat_history():
+    with st.container(horizontal=False, horizontal_alignment="left", gap=None):
+        st.button("New Chat", type="tertiary", on_click=new_chat)
+        for thread in get_threads(st.session_state.user_id):
+            # ⏸️ marks the chats waiting on a review
+            label = ("⏸️ " if thread["pending_interrupt"] else "") + thread["title"]
+            st.button(label, key=f"thread_{thread['id']}", type="tertiary", on_click=open_chat, args=(thread["id"],),
+                      disabled=thread["id"] == st.session_state.chat_id)
+
+def show_turn_metrics(summary):
+    # Time, tokens and cache lookups of each step of the last turn
+    st.caption(f"Last turn: {summary['seconds'] * 1000:.0f} ms")
+    steps = pd.DataFrame([{"Step": step,
+                           "ms": round(values["seconds"] * 1000, 1),
+                           "Calls": values["calls"],
+                           "Prompt tokens": values["prompt_tokens"],
+                           "Completion tokens": values["completion_tokens"],
+                           "Cache hits": values["cache_hits"],
+                           "Cache misses": values["cache_misses"]} for step, values in summary["steps"].items()])
+    st.dataframe(steps, hide_index=True)
+    if summary["storage"]:
+        storage = pd.DataFrame([{"Operation": operation, "ms": round(values["seconds"] * 1000, 1), "Calls": values["calls"]}
+                                for operation, values in summary["storage"].items()])
+        st.dataframe(storage, hide_index=True)
+
+
+filename="out/financial_plan.pdf"
+
+
+user_id = current_user_id()
+if "user_id" in st.session_state and st.session_state.user_id != user_id:
+    # Signed in or out: the open chat belongs to the other user
+    new_chat()
+st.session_state.user_id = user_id
 
 if "chat_id" not in st.session_state:
     st.session_state.chat_id = str(uuid.uuid4())
 
 if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Hello, How can I help you?", "metadata":{}}]
+    st.session_state.messages = [greeting()]
+
+if "history_window" not in st.session_state:
+    st.session_state.history_window = HISTORY_WINDOW
 
 if "financial_plan" not in st.session_state:
     st.session_state.financial_plan = {}
@@ -42,22 +195,30 @@ if "selection" not in st.session_state:
     st.session_state.selection = None
 
 
+# Sidebar: system message input
+with st.sidebar:
+    st.title("SaveUp")
+    with st.expander("See Chat History"):
+        # Filled at the end of the run, so a chat started in this run is listed
+        chat_history_panel = st.empty()
+    if st.session_state.get("financial_information"):
+        with st.expander("What-if Scenarios"):
+            # Every combination of time period, expense, salary, interest and inflation changes, no LLM call
+            count, summary = scenario_summary(st.session_state.financial_information)
+            if summary.empty:
+                st.write("Not enough financial information to compare scenarios yet.")
+            else:
+                st.caption(f"{count} scenarios by time period (months)")
+                st.dataframe(summary, hide_index=True)
+                st.line_chart(summary, x="months", y=["min_required_savings", "max_required_savings"])
+    # Filled at the end of the run, once the turn (if any) is done
+    metrics_panel = st.empty()
+    st.write("**Agent Graph**")
+    st.image("static/agent.png", caption="Agent Graph")
+
+
 # Display chat messages from history on app rerun
-for message in st.session_state.messages:
-    with st.chat_message(name=message["role"]):
-        st.markdown(message["content"], unsafe_allow_html=True)
-        if len(message["metadata"]) > 0:
-            if "financial_information" in message["metadata"]:
-                df = message["metadata"]["financial_information"]
-                st.dataframe(df,width="content", hide_index=True)
-        
-            if "pdf_buffer" in message["metadata"]:
-                pdf_buffer = message["metadata"]["pdf_buffer"]
-                st.download_button( label="⬇️ Download PDF",
-                                    key=datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
-                                    data=pdf_buffer,
-                                    file_name="financial_plan.pdf",
-                                    mime="application/pdf")
+show_chat(st.session_state.messages)
 
 
 # Handle new user input
@@ -70,50 +231,57 @@ if st.session_state.selection is not None:
 if user_message :
 
 
-    st.session_state.messages.append({"role": "user", "content": user_message, "metadata":{}})
+    st.session_state.messages.append(chat_message("user", selection_text(user_message)))
     with st.chat_message("user"):
-        st.markdown(user_message, unsafe_allow_html=True)
-
-    response, interruption = invoke(user_message,
-                        thread_id=st.session_state.chat_id,
-                        user_id=st.session_state.user_id)
-    ai_message =  response["messages"][-1].content
-    
-    metadata = {}
-    if interruption is not None:
-        financial_information =  interruption["financial_information"]
-        interruption_text =  interruption["question"]["text"]
-        interruption_options = interruption["question"]["options"]
-        ai_message = interruption_text
-
-        # Mapping function
-        financial_information = {key.replace("_", " ").title(): str(value) for key, value in financial_information.items()}
-        df = pd.DataFrame(list(financial_information.items()), columns=["Field", "Value"])
-
-
-        with st.chat_message("assistant"):
-            st.markdown(ai_message, unsafe_allow_html=True)
-            st.dataframe(df,width="content", hide_index=True)
-            flex = st.container(horizontal=True, horizontal_alignment="left")
-            for option in interruption_options:
-                flex.button(option, on_click=update_selection_value, args=(option,),  type="primary")
-            metadata = {"financial_information": df}
-
-    else:
-        with st.chat_message("assistant"):
-            st.markdown(ai_message, unsafe_allow_html=True)
+        st.markdown(selection_text(user_message), unsafe_allow_html=True)
+
+    message_id = str(uuid.uuid4())
+    with st.chat_message("assistant"):
+        # Render the reply while it is being generated
+        placeholder = st.empty()
+        ai_message = ""
+        for event in stream(user_message,
+                            thread_id=st.session_state.chat_id,
+                            user_id=st.session_state.user_id):
+            if event["type"] == "token":
+                ai_message += event["content"]
+                placeholder.markdown(ai_message, unsafe_allow_html=True)
+            elif event["type"] == "tool_start":
+                placeholder.markdown("<p><em>Working on your financial plan...</em></p>", unsafe_allow_html=True)
+            elif event["type"] == "done":
+                response, interruption, trace = event["response"], event["interruption"], event["trace"]
+        ai_message =  response["messages"][-1].content
+
+        metadata = {}
+        if interruption is not None:
+            financial_information =  interruption["financial_information"]
+            st.session_state.financial_information = financial_information
+            interruption_text =  interruption["question"]["text"]
+            ai_message = interruption_text
+
+            metadata = review_metadata(interruption)
+            placeholder.markdown(ai_message, unsafe_allow_html=True)
+            show_review(message_id, metadata)
+
+        else:
+            placeholder.markdown(ai_message, unsafe_allow_html=True)
             if "financial_plan" in response:
                 financial_plan = response["financial_plan"]
                 if financial_plan != st.session_state.financial_plan:
                     st.session_state.financial_plan = financial_plan
-                    pdf_buffer = generate_pdf_bytes(st.session_state.financial_plan)
-                    st.download_button( label="⬇️ Download PDF",
-                                        key=datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
-                                        data=pdf_buffer,
-                                        file_name="financial_plan.pdf",
-                                        mime="application/pdf"
-                                        )
-                    metadata = {"pdf_buffer": pdf_buffer}
-
-    st.session_state.messages.append({"role": "assistant", "content": ai_message, "metadata":metadata})
-    #print(ai_message)
\ No newline at end of file
+                    # Count the PDF rendering in the turn's breakdown
+                    with trace.activate():
+                        pdf_key = cache_plan_pdf(st.session_state.financial_plan)
+                    show_pdf_download(message_id, get_plan_pdf(pdf_key))
+                    metadata = {"pdf_key": pdf_key}
+
+    st.session_state.messages.append(chat_message("assistant", ai_message, metadata, message_id))
+    st.session_state.last_turn = trace.summary()
+    #print(ai_message)
+
+
+with metrics_panel.container():
+    turn_metrics_panel()
+
+with chat_history_panel.container():
+    show_chat_history()
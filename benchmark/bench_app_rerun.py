@@ -0,0 +1,88 @@
+"""Rerun time of `app.py` against the number of messages in the session.
+
+Run from the repository root:
+
+    python -m benchmark.bench_app_rerun --messages 10 50 200 800
+
+Each session is filled with a history of user/assistant turns in which every
+tenth reply carries a financial-information table and a plan PDF, then the app
+is rerun with `streamlit.testing.v1.AppTest` (no user input, so no model call).
+The table compares rendering the whole history against the default window.
+"""
+import time
+import uuid
+import argparse
+import statistics
+from pathlib import Path
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+from file_helper import cache_plan_pdf
+from benchmark.fake_llm import SAMPLE_FINANCIAL_INFORMATION, FakeChatModel, load_agent
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+SAMPLE_PLAN = {
+    "summary": "Save $80 a month for 5 months to buy the TV.",
+    "budgeting_recommendations": ["Track your expenses.", "Set aside $80 every payday."],
+    "savings_and_investment": ["Keep the TV fund in a savings account."],
+    "debt_management": ["Avoid paying for the TV on credit."],
+    "risk_and_emergency": ["Build a $150 emergency fund next."],
+    "next_steps": ["Open a dedicated savings account."],
+}
+
+
+def history(messages):
+    table = pd.DataFrame([(key.replace("_", " ").title(), str(value)) for key, value in SAMPLE_FINANCIAL_INFORMATION.items()],
+                         columns=["Field", "Value"])
+    pdf_key = cache_plan_pdf(SAMPLE_PLAN)
+    result = []
+    for index in range(messages):
+        if index % 2 == 0:
+            result.append({"id": str(uuid.uuid4()), "role": "user", "content": f"Message {index}", "metadata": {}})
+            continue
+        metadata = {}
+        if index % 20 == 1:
+            metadata = {"financial_information": table}
+        elif index % 20 == 11:
+            metadata = {"pdf_key": pdf_key}
+        result.append({"id": str(uuid.uuid4()), "role": "assistant", "content": f"<p>Reply {index}</p>", "metadata": metadata})
+    return result
+
+
+def rerun_time(messages, window, runs):
+    # AppTest resolves relative paths against the calling file, not the working directory
+    app = AppTest.from_file(str(APP_PATH), default_timeout=60)
+    app.secrets["CHAT_HISTORY_WINDOW"] = window
+    app.session_state["messages"] = history(messages)
+    app.run()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        app.run()
+        times.append(time.perf_counter() - start)
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, nargs="+", default=[10, 50, 200, 800])
+    parser.add_argument("--window", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # The sidebar reads the thread index, so the agent is built around the fake model
+    load_agent(FakeChatModel())
+
+    print(f"{'messages':>9} | {'full history ms':>16} | {'window ' + str(args.window) + ' ms':>16}")
+    for messages in args.messages:
+        full = rerun_time(messages, window=10**9, runs=args.runs)
+        windowed = rerun_time(messages, window=args.window, runs=args.runs)
+        print(f"{messages:>9} | {full * 1000:>16.1f} | {windowed * 1000:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Throughput of the async path (`ainvoke`) against the sync path (`invoke`).
+
+Run from the repository root:
+
+    python -m benchmark.bench_async_load --conversations 200 --turns 3 --latency 0.2
+
+Each conversation asks for a plan, accepts the review and says thanks, against a
+fake model that waits `--latency` seconds per call. The sync path runs the
+conversations one after the other (one blocked thread); the async path runs
+them all concurrently on a single event loop, at most `--concurrency` at a time.
+"""
+import time
+import uuid
+import asyncio
+import argparse
+
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+SCRIPT = ["I want to buy a TV for 400 dollars in 5 months, please make my plan", "ACCEPT", "Thanks!"]
+
+
+def run_sync(agent, conversations, turns):
+    for _ in range(conversations):
+        thread_id = str(uuid.uuid4())
+        for message in SCRIPT[:turns]:
+            agent.invoke(message, thread_id=thread_id, user_id=thread_id)
+
+
+async def run_async(agent, conversations, turns, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def conversation():
+        async with semaphore:
+            thread_id = str(uuid.uuid4())
+            for message in SCRIPT[:turns]:
+                await agent.ainvoke(message, thread_id=thread_id, user_id=thread_id)
+
+    await asyncio.gather(*(conversation() for _ in range(conversations)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--sync-conversations", type=int, default=10,
+                        help="The sync path is slow; its throughput is measured on fewer conversations")
+    parser.add_argument("--turns", type=int, default=3, choices=range(1, len(SCRIPT) + 1))
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=500)
+    args = parser.parse_args()
+
+    agent = load_agent(FakeChatModel(latency=args.latency))
+
+    start = time.perf_counter()
+    run_sync(agent, args.sync_conversations, args.turns)
+    sync_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asyncio.run(run_async(agent, args.conversations, args.turns, args.concurrency))
+    async_elapsed = time.perf_counter() - start
+    agent.memory_writer.flush()
+
+    sync_rate = args.sync_conversations * args.turns / sync_elapsed
+    async_rate = args.conversations * args.turns / async_elapsed
+    print(f"sync : {args.sync_conversations:>5} conversations in {sync_elapsed:7.2f}s -> {sync_rate:8.1f} turns/s")
+    print(f"async: {args.conversations:>5} conversations in {async_elapsed:7.2f}s -> {async_rate:8.1f} turns/s")
+    print(f"speed-up: {async_rate / sync_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Prompt tokens per turn across a scripted 200-turn conversation.
+
+Run from the repository root:
+
+    python -m benchmark.bench_context_window --turns 200
+
+The same script is played twice with a stubbed model: once with the budget
+disabled (the whole history is sent, as before) and once with the default
+context budget. Token counts use the same approximation as `agent.context`.
+"""
+import uuid
+import argparse
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages.utils import count_tokens_approximately
+
+from agent.context import DEFAULT_CONTEXT_TOKEN_BUDGET
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+USER_TURNS = [
+    "I want to buy a TV that costs 400 dollars and I'd like to understand my options before deciding anything.",
+    "I currently have no savings, and my monthly expenses are about 50 dollars between food and transport.",
+    "My monthly salary is 500 dollars, although it sometimes changes a little depending on extra shifts.",
+    "Could you explain how an emergency fund works and why I should care about it right now?",
+]
+
+
+class PromptTokenCounter(BaseCallbackHandler):
+    """Count the prompt tokens of every chat model call, split by purpose."""
+
+    def __init__(self):
+        self.assistant_calls = []
+        self.summary_calls = []
+
+    def on_chat_model_start(self, serialized, messages, *, tags=None, **kwargs):
+        tokens = count_tokens_approximately(messages[0])
+        if tags and "summarize" in tags:
+            self.summary_calls.append(tokens)
+        else:
+            self.assistant_calls.append(tokens)
+
+
+def play(agent, turns, budget):
+    counter = PromptTokenCounter()
+    agent.MODEL.callbacks = [counter]
+    config = {"configurable": {"thread_id": str(uuid.uuid4()), "user_id": "bench", "context_token_budget": budget}}
+    for turn in range(turns):
+        agent.graph.invoke({"messages": [("user", USER_TURNS[turn % len(USER_TURNS)])]}, config=config)
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--budget", type=int, default=DEFAULT_CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--every", type=int, default=20)
+    args = parser.parse_args()
+
+    model = FakeChatModel(reply="<p>" + "Here is some friendly, detailed guidance about your finances. " * 6 + "</p>")
+    agent = load_agent(model)
+    full = play(agent, args.turns, budget=10**9)
+    budgeted = play(agent, args.turns, budget=args.budget)
+
+    print(f"{'turn':>5} | {'full history':>12} | {'budget ' + str(args.budget):>12}")
+    for turn in [1] + list(range(args.every, args.turns + 1, args.every)):
+        print(f"{turn:>5} | {full.assistant_calls[turn - 1]:>12} | {budgeted.assistant_calls[turn - 1]:>12}")
+    print(f"total assistant prompt tokens: {sum(full.assistant_calls)} vs {sum(budgeted.assistant_calls)}")
+    print(f"summary refreshes: {len(budgeted.summary_calls)} "
+          f"({sum(budgeted.summary_calls)} prompt tokens)")
+
+
+if __name__ == "__main__":
+    main()
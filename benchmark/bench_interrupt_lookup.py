@@ -0,0 +1,66 @@
+"""Per-turn latency of `invoke` over a long thread with a stubbed model.
+
+Run from the repository root:
+
+    python -m benchmark.bench_interrupt_lookup --turns 500
+
+Every `--plan-every` turns the user asks for a plan and then answers the review
+interrupt, so the interrupt lookup is exercised on both branches. The table
+compares the lookup on its own (`has_pending_interrupt`, one read of the
+thread index) against the old full-history scan; the whole `invoke` is shown
+for reference.
+"""
+import time
+import uuid
+import argparse
+import statistics
+
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--plan-every", type=int, default=50)
+    parser.add_argument("--bucket", type=int, default=50)
+    args = parser.parse_args()
+
+    agent = load_agent(FakeChatModel())
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id, "user_id": "bench"}}
+
+    turn_times, lookup_times, history_times = [], [], []
+    pending = False
+    for turn in range(1, args.turns + 1):
+        if pending:
+            message = "ACCEPT"
+        elif turn % args.plan_every == 0:
+            message = "Please generate my plan"
+        else:
+            message = f"Turn {turn}: tell me something"
+
+        start = time.perf_counter()
+        _, interruption = agent.invoke(message, thread_id=thread_id, user_id="bench")
+        turn_times.append(time.perf_counter() - start)
+        pending = interruption is not None
+
+        start = time.perf_counter()
+        agent.has_pending_interrupt(config)
+        lookup_times.append(time.perf_counter() - start)
+
+        # What the previous implementation paid on every turn just to find the interrupts
+        start = time.perf_counter()
+        list(agent.graph.get_state_history(config))
+        history_times.append(time.perf_counter() - start)
+
+    print(f"{'turns':>11} | {'lookup ms (mean)':>16} | {'history scan ms (mean)':>22} | {'invoke ms (mean)':>16}")
+    for first in range(0, args.turns, args.bucket):
+        window = slice(first, first + args.bucket)
+        print(f"{first + 1:>5}-{min(first + args.bucket, args.turns):<5} | "
+              f"{statistics.mean(lookup_times[window]) * 1000:>16.3f} | "
+              f"{statistics.mean(history_times[window]) * 1000:>22.2f} | "
+              f"{statistics.mean(turn_times[window]) * 1000:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
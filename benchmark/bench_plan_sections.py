@@ -0,0 +1,49 @@
+"""Plan generation latency: one structured call against parallel sections.
+
+Run from the repository root:
+
+    python -m benchmark.bench_plan_sections --latency 0.5 --token-latency 0.02 --runs 5
+
+The fake model waits `--latency` seconds per call plus `--token-latency` per
+output token, so a call that writes the whole plan takes longer than a call
+that writes one section. Caches are disabled so every run calls the model.
+"""
+import time
+import asyncio
+import argparse
+import statistics
+
+from benchmark.fake_llm import SAMPLE_FINANCIAL_INFORMATION, FakeChatModel, load_agent
+
+
+def measure(agent, runs, use_async):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        if use_async:
+            asyncio.run(agent.acreate_plan(dict(SAMPLE_FINANCIAL_INFORMATION)))
+        else:
+            agent.create_plan(dict(SAMPLE_FINANCIAL_INFORMATION))
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    model = FakeChatModel(latency=args.latency, token_latency=args.token_latency)
+    print(f"{'mode':<10} | {'sync ms':>10} | {'async ms':>10}")
+    for mode in ("single", "sectioned"):
+        agent = load_agent(model, plan_generation=mode, plan_cache_entries=0, speculative_plans=0)
+        sync = measure(agent, args.runs, use_async=False)
+        asynchronous = measure(agent, args.runs, use_async=True)
+        print(f"{mode:<10} | {sync * 1000:>10.0f} | {asynchronous * 1000:>10.0f}")
+        agent.memory_writer.close()
+
+
+if __name__ == "__main__":
+    main()
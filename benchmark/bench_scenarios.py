@@ -0,0 +1,40 @@
+"""Time to evaluate a what-if scenario grid.
+
+Run from the repository root:
+
+    python -m benchmark.bench_scenarios --repeat 50
+"""
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+from agent.scenarios import evaluate_scenarios
+from benchmark.fake_llm import SAMPLE_FINANCIAL_INFORMATION
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    grid = {
+        "time_periods": range(1, 61),
+        "expense_deltas": np.linspace(-0.3, 0.3, 13),
+        "salary_deltas": np.linspace(-0.2, 0.2, 9),
+        "interest_rates": (0.0, 0.02, 0.04, 0.06),
+        "inflation_rates": (0.0, 0.03),
+    }
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        table = evaluate_scenarios(SAMPLE_FINANCIAL_INFORMATION, **grid)
+        timings.append(time.perf_counter() - start)
+
+    print(f"{len(table)} scenarios, {table['feasible'].mean():.0%} feasible")
+    print(f"median {statistics.median(timings) * 1000:.2f} ms, best {min(timings) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
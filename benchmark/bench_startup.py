@@ -0,0 +1,54 @@
+"""Import time of `agent.agent` and latency of the first requests.
+
+Run from the repository root:
+
+    python -m benchmark.bench_startup --runs 10
+
+Each run is a fresh interpreter, so module caches are cold. It reports the time
+to import `agent.agent` (which builds nothing), the time to build the app
+around the fake model, and the latency of the first and second `invoke`.
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Executed in a fresh interpreter for every run
+PROBE = """
+import json, time, uuid
+start = time.perf_counter()
+from agent import agent
+imported = time.perf_counter()
+from benchmark.fake_llm import FakeChatModel
+agent.configure(model=FakeChatModel())
+built = time.perf_counter()
+thread_id = str(uuid.uuid4())
+agent.invoke("Hi, I want to save some money", thread_id=thread_id, user_id="bench")
+first = time.perf_counter()
+agent.invoke("My salary is $500 a month", thread_id=thread_id, user_id="bench")
+second = time.perf_counter()
+agent.get_app().memory_writer.close()
+print(json.dumps({"import": imported - start, "build": built - imported,
+                  "first request": first - built, "second request": second - first}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    samples = {}
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True).stdout
+        for name, seconds in json.loads(output.strip().splitlines()[-1]).items():
+            samples.setdefault(name, []).append(seconds * 1000)
+
+    print(f"{'phase':<16}{'median ms':>12}{'min ms':>12}{'max ms':>12}")
+    for name, values in samples.items():
+        print(f"{name:<16}{statistics.median(values):>12.1f}{min(values):>12.1f}{max(values):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
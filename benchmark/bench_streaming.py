@@ -0,0 +1,64 @@
+"""Time to first token of `stream` against the blocking `invoke`.
+
+Run from the repository root:
+
+    python -m benchmark.bench_streaming --turns 20 --latency 0.3 --token-latency 0.02
+
+The stubbed model waits `--latency` seconds before its first token and
+`--token-latency` seconds between tokens. With `invoke` nothing can be shown
+until the whole turn is done, so its time to first token is its total time.
+"""
+import time
+import uuid
+import argparse
+import statistics
+
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    model = FakeChatModel(latency=args.latency, token_latency=args.token_latency,
+                          reply="<p>" + "Here is a step you can take to reach your goal sooner. " * 5 + "</p>")
+    agent = load_agent(model)
+
+    invoke_totals = []
+    thread_id = str(uuid.uuid4())
+    for turn in range(args.turns):
+        start = time.perf_counter()
+        agent.invoke(f"Turn {turn}: how am I doing?", thread_id=thread_id, user_id="bench")
+        invoke_totals.append(time.perf_counter() - start)
+
+    first_tokens, stream_totals = [], []
+    thread_id = str(uuid.uuid4())
+    for turn in range(args.turns):
+        start = time.perf_counter()
+        first_token = None
+        for event in agent.stream(f"Turn {turn}: how am I doing?", thread_id=thread_id, user_id="bench"):
+            if event["type"] == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+        stream_totals.append(time.perf_counter() - start)
+        first_tokens.append(first_token)
+
+    agent.memory_writer.flush()
+
+    print(f"{'':>22} | {'p50 ms':>8} | {'p99 ms':>8} | {'mean ms':>8}")
+    for label, values in [("invoke first content", invoke_totals),
+                          ("stream first token", first_tokens),
+                          ("stream total", stream_totals)]:
+        print(f"{label:>22} | {percentile(values, 50) * 1000:>8.1f} | "
+              f"{percentile(values, 99) * 1000:>8.1f} | {statistics.mean(values) * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""End-to-end benchmark and load test of the real graph with the fake model.
+
+Run from the repository root:
+
+    python -m benchmark.bench_suite --conversations 50 --latency 0.05
+
+Every conversation plays the TV example: the user shares their goal and
+finances, asks for a plan, accepts the review interrupt, and the plan is
+rendered to PDF. Nothing leaves the machine. The report covers:
+    - per-turn latency (p50/p99) and prompt tokens of every step of the script;
+    - wall time spent in each graph node;
+    - memory kept per thread (tracemalloc, after the memory writer settled);
+    - throughput of concurrent sessions, one thread per session like Streamlit.
+
+The plan cache is disabled by default so every conversation generates its plan.
+`--review-seconds` waits before accepting the review, like a user reading the
+information; the plan is generated speculatively in the meantime unless
+`--no-speculation` is given.
+"""
+import gc
+import time
+import functools
+import uuid
+import argparse
+import statistics
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages.utils import count_tokens_approximately
+
+from file_helper import render_plan_pdf
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+# (step, user message) of the scripted conversation; "request plan" raises the review interrupt
+SCRIPT = [
+    ("greeting", "Hi! I would like to buy a TV."),
+    ("goal", "It costs 400 dollars and I want to buy it in 5 months."),
+    ("finances", "My salary is 500 dollars a month, my expenses are about 50 and I have no savings."),
+    ("request plan", "That's all, please make my plan."),
+    ("accept", "ACCEPT"),
+]
+
+
+class TurnRecorder(BaseCallbackHandler):
+    """Wall time per graph node and prompt tokens of the model calls of one turn."""
+
+    def __init__(self):
+        self.node_seconds = defaultdict(float)
+        self.prompt_tokens = 0
+        self._starts = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # Only the node runnable itself, not the chains running inside it
+        if node and kwargs.get("name") == node:
+            self._starts[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._stop(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # The review interrupt ends the tools node with an error
+        self._stop(run_id)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompt_tokens += count_tokens_approximately(messages[0])
+
+    def _stop(self, run_id):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            node, start = started
+            self.node_seconds[node] += time.perf_counter() - start
+
+
+def run_conversation(agent, review_seconds=0.0):
+    """Play the script on a new thread and user; returns one sample per step."""
+    thread_id = str(uuid.uuid4())
+    samples = []
+    response = interruption = None
+    for step, message in SCRIPT:
+        if step == "accept":
+            time.sleep(review_seconds)
+        recorder = TurnRecorder()
+        start = time.perf_counter()
+        response, interruption = agent.invoke(message, thread_id=thread_id, user_id=thread_id, callbacks=[recorder])
+        samples.append({"step": step, "seconds": time.perf_counter() - start,
+                        "nodes": dict(recorder.node_seconds), "prompt_tokens": recorder.prompt_tokens})
+        if step == "request plan" and interruption is None:
+            raise RuntimeError("The plan request did not raise the review interrupt")
+
+    if "financial_plan" not in response:
+        raise RuntimeError("Accepting the review did not produce a plan")
+    start = time.perf_counter()
+    render_plan_pdf(response["financial_plan"])
+    samples.append({"step": "pdf", "seconds": time.perf_counter() - start, "nodes": {}, "prompt_tokens": 0})
+    return samples
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(q / 100 * (len(values) - 1)))]
+
+
+def report_turns(conversations):
+    by_step = defaultdict(list)
+    for samples in conversations:
+        for sample in samples:
+            by_step[sample["step"]].append(sample)
+
+    print(f"\n{'step':<14}{'p50 ms':>10}{'p99 ms':>10}{'prompt tokens':>15}")
+    for step, samples in by_step.items():
+        milliseconds = [sample["seconds"] * 1000 for sample in samples]
+        tokens = statistics.mean(sample["prompt_tokens"] for sample in samples)
+        print(f"{step:<14}{percentile(milliseconds, 50):>10.1f}{percentile(milliseconds, 99):>10.1f}{tokens:>15.0f}")
+
+    node_seconds = defaultdict(list)
+    for samples in conversations:
+        for sample in samples:
+            for node, seconds in sample["nodes"].items():
+                node_seconds[node].append(seconds * 1000)
+    print(f"\n{'node':<14}{'calls':>10}{'p50 ms':>10}{'p99 ms':>10}{'total ms':>12}")
+    for node, milliseconds in sorted(node_seconds.items()):
+        print(f"{node:<14}{len(milliseconds):>10}{percentile(milliseconds, 50):>10.1f}"
+              f"{percentile(milliseconds, 99):>10.1f}{sum(milliseconds):>12.0f}")
+
+
+def measure_memory(agent, play, threads):
+    """Bytes still allocated per finished thread (checkpoints, store items, caches)."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(threads):
+        play()
+    agent.memory_writer.flush()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    growth = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"\nmemory: {growth / 1024:.0f} KiB over {threads} threads -> {growth / threads / 1024:.1f} KiB per thread")
+    for stat in after.compare_to(before, "filename")[:5]:
+        print(f"    {stat.size_diff / 1024:>10.1f} KiB  {stat.traceback[0].filename}")
+
+
+def measure_throughput(play, concurrency_levels, conversations_per_worker):
+    print(f"\n{'sessions':<10}{'conversations':>15}{'seconds':>10}{'turns/s':>10}")
+    for concurrency in concurrency_levels:
+        conversations = concurrency * conversations_per_worker
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda _: play(), range(conversations)))
+        elapsed = time.perf_counter() - start
+        print(f"{concurrency:<10}{conversations:>15}{elapsed:>10.2f}{conversations * len(SCRIPT) / elapsed:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=50, help="Sequential conversations for the latency report")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the fake model waits per call")
+    parser.add_argument("--memory-threads", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--conversations-per-session", type=int, default=3)
+    parser.add_argument("--plan-cache", action="store_true", help="Keep the plan cache enabled")
+    parser.add_argument("--review-seconds", type=float, default=0.0, help="Wait before accepting the review")
+    parser.add_argument("--no-speculation", action="store_true", help="Generate the plan only once accepted")
+    args = parser.parse_args()
+
+    config = {} if args.plan_cache else {"plan_cache_entries": 0}
+    if args.no_speculation:
+        config["speculative_plans"] = 0
+    agent = load_agent(FakeChatModel(latency=args.latency), **config)
+    play = functools.partial(run_conversation, agent, review_seconds=args.review_seconds)
+
+    # The first conversation pays for imports and lazy initialization
+    play()
+
+    start = time.perf_counter()
+    conversations = [play() for _ in range(args.conversations)]
+    print(f"{args.conversations} conversations in {time.perf_counter() - start:.2f}s "
+          f"(fake model latency {args.latency * 1000:.0f} ms per call)")
+    report_turns(conversations)
+    measure_memory(agent, play, args.memory_threads)
+    measure_throughput(play, args.concurrency, args.conversations_per_session)
+    agent.memory_writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Deterministic fake chat model used to drive the agent offline."""
+import re
+import json
+import time
+import asyncio
+import uuid
+import typing
+from typing import Any, List, Optional
+
+from pydantic import BaseModel
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+# The financial information the fake "extracts" when it decides to call the tool
+SAMPLE_FINANCIAL_INFORMATION = {
+    "financial_goal": "buy a TV",
+    "goal_amount": 400,
+    "savings": 0,
+    "time_period": "5 months",
+    "monthly_expenses": 50,
+    "salary": 500,
+}
+
+# A user message containing this word makes the fake call `generate_financial_plan`
+PLAN_TRIGGER = "plan"
+
+
+def _tokens(text: str) -> List[str]:
+    """Split text into word-sized streaming tokens."""
+    return re.findall(r"\S+\s*", text)
+
+
+def _fill(schema: type[BaseModel]) -> dict:
+    """Build a valid payload for a pydantic schema with placeholder values."""
+    payload = {}
+    for name, field in schema.model_fields.items():
+        annotation = field.annotation
+        if typing.get_origin(annotation) in (list, List):
+            payload[name] = [f"{name} item {i}" for i in range(1, 4)]
+        elif annotation is str:
+            payload[name] = f"{name} text"
+        else:
+            payload[name] = None
+    return payload
+
+
+class FakeChatModel(BaseChatModel):
+    """Scripted chat model that supports tool calls and structured output.
+
+    The reply depends only on the last message, so a conversation is fully
+    reproducible. `latency` is slept before the first token of every call and
+    `token_latency` before each following token, to mimic a remote model.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    reply: str = "<p>Thanks, could you tell me a bit more about your finances?</p>"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-saveup"
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[list], structured_output: Optional[str] = None) -> AIMessage:
+        if structured_output:
+            # The JSON payload, so the token latency grows with the size of the schema
+            return AIMessage(content=structured_output)
+        last_message = messages[-1]
+        wants_plan = isinstance(last_message, HumanMessage) and PLAN_TRIGGER in str(last_message.content).lower()
+        if tools and wants_plan:
+            return AIMessage(content="", tool_calls=[{
+                "name": "generate_financial_plan",
+                "args": {"financial_information": dict(SAMPLE_FINANCIAL_INFORMATION)},
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+            }])
+        return AIMessage(content=self.reply)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools"), kwargs.get("structured_output"))
+        time.sleep(self.token_latency * len(_tokens(message.content)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any):
+        time.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools"), kwargs.get("structured_output"))
+        if message.tool_calls:
+            tool_call_chunks = [{"name": tool_call["name"], "args": json.dumps(tool_call["args"]),
+                                 "id": tool_call["id"], "index": index}
+                                for index, tool_call in enumerate(message.tool_calls)]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks))
+            return
+        for index, token in enumerate(_tokens(message.content)):
+            if index:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools"), kwargs.get("structured_output"))
+        await asyncio.sleep(self.token_latency * len(_tokens(message.content)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools"), kwargs.get("structured_output"))
+        if message.tool_calls:
+            tool_call_chunks = [{"name": tool_call["name"], "args": json.dumps(tool_call["args"]),
+                                 "id": tool_call["id"], "index": index}
+                                for index, tool_call in enumerate(message.tool_calls)]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks))
+            return
+        for index, token in enumerate(_tokens(message.content)):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        # A real model call (latency, callbacks, prompt tokens) followed by a placeholder payload
+        payload = _fill(schema)
+        return self.bind(structured_output=json.dumps(payload)) | RunnableLambda(lambda _message: schema(**payload))
+
+
+def load_agent(model: BaseChatModel, **config):
+    """Import `agent.agent` and build it around `model`, without Streamlit secrets or an OpenAI client.
+
+    Keyword arguments override the `AgentConfig` defaults.
+    """
+    from agent import agent
+    from agent.config import AgentConfig
+
+    agent.configure(AgentConfig(**config), model=model)
+    return agent
@@ -0,0 +1,163 @@
+"""Export financial plans as PDFs in bulk.
+
+Plans come from a JSONL file (one plan per line, either the plan itself or
+{"id": ..., "financial_plan": {...}}) or from the latest plan of every user in
+the SQLite store. They are rendered across a process pool and written to a
+directory or a single zip file, with a JSONL report of the time taken and the
+error (if any) of each document.
+
+    python export_plans.py --input plans.jsonl --output out/plans
+    python export_plans.py --from-store data/saveup.sqlite --zip out/plans.zip
+"""
+import os
+import re
+import sys
+import json
+import time
+import zipfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from file_helper import render_plan_pdf
+
+
+def read_jsonl(path):
+    """Yield (document id, plan, error) for every line of a JSONL file.
+
+    A line that can't be read is yielded with its error, so it is reported
+    without stopping the export.
+    """
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield str(line_number), None, f"{type(error).__name__}: {error}"
+                continue
+            if not isinstance(record, dict):
+                yield str(line_number), None, f"Expected a JSON object, got {type(record).__name__}"
+            elif "financial_plan" in record:
+                yield str(record.get("id", line_number)), record["financial_plan"], None
+            else:
+                yield str(line_number), record, None
+
+
+def read_store(path, page_size=100):
+    """Yield (user id, latest plan, None) for every user with a plan in the SQLite store."""
+    from langgraph.store.sqlite import SqliteStore
+    from agent.persistence import connect_sqlite
+
+    store = SqliteStore(connect_sqlite(path))
+    offset = 0
+    while True:
+        namespaces = store.list_namespaces(suffix=("financial_plan",), limit=page_size, offset=offset)
+        for namespace in namespaces:
+            item = store.get(namespace, "latest")
+            if item is not None:
+                yield namespace[0], item.value["financial_plan"], None
+        if len(namespaces) < page_size:
+            return
+        offset += page_size
+
+
+def render(document_id, plan):
+    """Worker: render one plan, returning (id, PDF bytes or None, seconds, error or None)."""
+    start = time.perf_counter()
+    try:
+        return document_id, render_plan_pdf(plan), time.perf_counter() - start, None
+    except Exception as error:
+        return document_id, None, time.perf_counter() - start, f"{type(error).__name__}: {error}"
+
+
+def safe_filename(document_id):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", document_id) + ".pdf"
+
+
+def export(documents, write, workers=None, max_pending=None):
+    """Render `documents` on a process pool and pass each result to `write`.
+
+    At most `max_pending` plans are queued at once, so memory stays bounded no
+    matter how many documents there are. Yields one report entry per document;
+    documents that came with a read error are reported without being rendered.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for document_id, plan, error in documents:
+            if error is not None:
+                yield {"id": document_id, "seconds": 0.0, "bytes": 0, "error": error}
+                continue
+            pending.add(executor.submit(render, document_id, plan))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _collect(done, write)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _collect(done, write)
+
+
+def _collect(done, write):
+    for future in done:
+        document_id, pdf, seconds, error = future.result()
+        if error is None:
+            write(safe_filename(document_id), pdf)
+        yield {"id": document_id, "seconds": round(seconds, 4), "bytes": len(pdf) if pdf else 0, "error": error}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="JSONL file of plans")
+    source.add_argument("--from-store", help="SQLite database of the app (PERSISTENCE_BACKEND = \"sqlite\")")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="Directory to write the PDFs to")
+    target.add_argument("--zip", help="Zip file to write the PDFs to")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--report", default=None, help="JSONL report path (default: next to the output)")
+    args = parser.parse_args()
+
+    documents = read_jsonl(args.input) if args.input else read_store(args.from_store)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        report_path = args.report or os.path.join(args.output, "export_report.jsonl")
+        archive = None
+
+        def write(name, pdf):
+            with open(os.path.join(args.output, name), "wb") as file:
+                file.write(pdf)
+    else:
+        if os.path.dirname(args.zip):
+            os.makedirs(os.path.dirname(args.zip), exist_ok=True)
+        report_path = args.report or os.path.splitext(args.zip)[0] + "_report.jsonl"
+        # PDFs are already compressed
+        archive = zipfile.ZipFile(args.zip, "w", compression=zipfile.ZIP_STORED)
+
+        def write(name, pdf):
+            archive.writestr(name, pdf)
+
+    start = time.perf_counter()
+    exported = failed = 0
+    try:
+        with open(report_path, "w", encoding="utf-8") as report:
+            for entry in export(documents, write, workers=args.workers):
+                report.write(json.dumps(entry) + "\n")
+                if entry["error"] is None:
+                    exported += 1
+                else:
+                    failed += 1
+                    print(f"❌ {entry['id']}: {entry['error']}", file=sys.stderr)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {exported} PDFs exported, {failed} failed in {elapsed:.1f}s "
+          f"({exported / elapsed if elapsed else 0:.1f} docs/s). Report: {report_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,95 +1,172 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from io import BytesIO
+from collections import OrderedDict
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, ListFlowable, ListItem
 from reportlab.lib.enums import TA_CENTER
-from io import BytesIO
 
-def generate_financial_plan_pdf(data: dict, filename="financial_plan.pdf"):
-    # Create the PDF document
-    doc = SimpleDocTemplate(filename, pagesize=LETTER)
+from agent.metrics import record_cache, timed
+
+# Styles are built once and shared by every render
+STYLES = getSampleStyleSheet()
+TITLE_STYLE = ParagraphStyle('title_style', parent=STYLES['Heading1'], alignment=TA_CENTER, fontSize=16, spaceAfter=20)
+SECTION_STYLE = STYLES['Heading2']
+BODY_STYLE = STYLES['Normal']
+
+# (title, plan key) of the bullet list sections, in order
+LIST_SECTIONS = [
+    ("Budgeting Recommendations", "budgeting_recommendations"),
+    ("Savings and Investment", "savings_and_investment"),
+    ("Debt Management", "debt_management"),
+    ("Risk and Emergency Planning", "risk_and_emergency"),
+    ("Next Steps", "next_steps"),
+]
+
+
+class PdfCache:
+    """Rendered PDFs by plan hash.
+
+    At most `max_bytes` of PDFs stay in memory; the least recently used ones are
+    spilled to temporary files, and the oldest spilled files are deleted beyond
+    `max_spill_bytes`.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, max_spill_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self._memory = OrderedDict()   # key -> PDF bytes
+        self._spilled = OrderedDict()  # key -> (path, size)
+        self._memory_bytes = 0
+        self._spill_bytes = 0
+        self._spill_dir = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._memory or key in self._spilled
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            if key in self._spilled:
+                path, _ = self._spilled[key]
+                self._spilled.move_to_end(key)
+                try:
+                    with open(path, "rb") as file:
+                        return file.read()
+                except OSError:
+                    return None
+        return None
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+                spilled_key, spilled_data = self._memory.popitem(last=False)
+                self._memory_bytes -= len(spilled_data)
+                self._spill(spilled_key, spilled_data)
+
+    def _spill(self, key, data):
+        if key in self._spilled:
+            return
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="saveup-pdf-")
+        path = os.path.join(self._spill_dir, f"{key}.pdf")
+        with open(path, "wb") as file:
+            file.write(data)
+        self._spilled[key] = (path, len(data))
+        self._spill_bytes += len(data)
+        while self._spill_bytes > self.max_spill_bytes and self._spilled:
+            _, (old_path, size) = self._spilled.popitem(last=False)
+            self._spill_bytes -= size
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+# Shared by every session of the process
+pdf_cache = PdfCache()
+
+
+def plan_hash(data: dict):
+    """Content hash of a financial plan."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def render_plan_pdf(data: dict):
+    """Render a financial plan to PDF bytes."""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=LETTER)
     elements = []
 
-    # Styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'title_style',
-        parent=styles['Heading1'],
-        alignment=TA_CENTER,
-        fontSize=16,
-        spaceAfter=20
-    )
-    section_style = styles['Heading2']
-    body_style = styles['Normal']
-
     # Title
-    elements.append(Paragraph("Personal Financial Plan", title_style))
+    elements.append(Paragraph("Personal Financial Plan", TITLE_STYLE))
     elements.append(Spacer(1, 12))
 
     # Summary
-    elements.append(Paragraph("Summary", section_style))
-    elements.append(Paragraph(data['summary'], body_style))
+    elements.append(Paragraph("Summary", SECTION_STYLE))
+    elements.append(Paragraph(data['summary'], BODY_STYLE))
     elements.append(Spacer(1, 12))
 
-    # Helper function for lists
-    def add_list_section(title, items):
-        elements.append(Paragraph(title, section_style))
+    # Sections
+    for title, key in LIST_SECTIONS:
+        elements.append(Paragraph(title, SECTION_STYLE))
         bullet_list = ListFlowable(
-            [ListItem(Paragraph(item, body_style)) for item in items],
+            [ListItem(Paragraph(item, BODY_STYLE)) for item in data[key]],
             bulletType='bullet',
             start='disc'
         )
         elements.append(bullet_list)
         elements.append(Spacer(1, 12))
 
-    # Sections
-    add_list_section("Budgeting Recommendations", data['budgeting_recommendations'])
-    add_list_section("Savings and Investment", data['savings_and_investment'])
-    add_list_section("Debt Management", data['debt_management'])
-    add_list_section("Risk and Emergency Planning", data['risk_and_emergency'])
-    add_list_section("Next Steps", data['next_steps'])
-
     # Build PDF
     doc.build(elements)
-    print(f"✅ PDF generated: {filename}")
+    return buffer.getvalue()
 
 
+def plan_pdf_bytes(data: dict):
+    """PDF bytes of a plan, rendered only the first time the same plan is seen."""
+    key = plan_hash(data)
+    pdf = pdf_cache.get(key)
+    record_cache("pdf", pdf is not None)
+    if pdf is None:
+        with timed("pdf_render"):
+            pdf = render_plan_pdf(data)
+        pdf_cache.put(key, pdf)
+    return pdf
 
-# PDF generation function returning bytes
-def generate_pdf_bytes(data: dict):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=LETTER)
-    elements = []
 
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('title_style', parent=styles['Heading1'], alignment=TA_CENTER, fontSize=16, spaceAfter=20)
-    section_style = styles['Heading2']
-    body_style = styles['Normal']
+def cache_plan_pdf(data: dict):
+    """Render a plan once and return the key to fetch its PDF with `get_plan_pdf`."""
+    plan_pdf_bytes(data)
+    return plan_hash(data)
 
-    elements.append(Paragraph("Personal Financial Plan", title_style))
-    elements.append(Spacer(1, 12))
-    elements.append(Paragraph("Summary", section_style))
-    elements.append(Paragraph(data['summary'], body_style))
-    elements.append(Spacer(1, 12))
 
-    def add_list_section(title, items):
-        elements.append(Paragraph(title, section_style))
-        bullet_list = ListFlowable(
-            [ListItem(Paragraph(item, body_style)) for item in items],
-            bulletType='bullet',
-            start='disc'
-        )
-        elements.append(bullet_list)
-        elements.append(Spacer(1, 12))
+def get_plan_pdf(key: str):
+    """PDF bytes for a key from `cache_plan_pdf` (None if they were evicted)."""
+    return pdf_cache.get(key)
 
-    add_list_section("Budgeting Recommendations", data['budgeting_recommendations'])
-    add_list_section("Savings and Investment", data['savings_and_investment'])
-    add_list_section("Debt Management", data['debt_management'])
-    add_list_section("Risk and Emergency Planning", data['risk_and_emergency'])
-    add_list_section("Next Steps", data['next_steps'])
 
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
+def generate_financial_plan_pdf(data: dict, filename="financial_plan.pdf"):
+    with open(filename, "wb") as file:
+        file.write(plan_pdf_bytes(data))
+    print(f"✅ PDF generated: {filename}")
+
+
+# PDF generation function returning bytes
+def generate_pdf_bytes(data: dict):
+    return BytesIO(plan_pdf_bytes(data))
 
 if __name__ == "__main__":
     financial_data = {
@@ -0,0 +1,26 @@
+import socket
+import urllib.request
+
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_configure_again_closes_the_previous_app(tmp_path):
+    port = free_port()
+    path = str(tmp_path / "saveup.sqlite")
+    agent = load_agent(FakeChatModel(), metrics_port=port, persistence_backend="sqlite", sqlite_path=path)
+    previous = agent.get_app()
+    agent.invoke("How am I doing?", thread_id="1", user_id="1")
+
+    # The metrics port and the database are free for the new app
+    load_agent(FakeChatModel(), metrics_port=port, persistence_backend="sqlite", sqlite_path=path)
+    assert agent.get_app() is not previous
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        assert response.status == 200
+    assert [thread["id"] for thread in agent.get_threads("1")] == ["1"]
+    agent.get_app().close()
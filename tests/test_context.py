@@ -0,0 +1,8 @@
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+
+def test_token_budget_reaches_the_run_config():
+    agent = load_agent(FakeChatModel(), context_token_budget=123)
+    config, _ = agent.prepare_turn("Hi!", thread_id="1", user_id="1")
+    assert config["configurable"]["context_token_budget"] == 123
+    agent.memory_writer.close()
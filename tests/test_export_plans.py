@@ -0,0 +1,18 @@
+import json
+
+from export_plans import export, read_jsonl
+
+PLAN = {"summary": "Save $80 a month for 5 months.", "budgeting_recommendations": ["Track your expenses."],
+        "savings_and_investment": ["Keep the fund in a savings account."], "debt_management": ["Avoid credit."],
+        "risk_and_emergency": ["Build an emergency fund."], "next_steps": ["Open a savings account."]}
+
+
+def test_malformed_lines_are_reported(tmp_path):
+    path = tmp_path / "plans.jsonl"
+    path.write_text(json.dumps(PLAN) + "\n{broken\n" + json.dumps({"id": "x", "financial_plan": PLAN}) + "\n")
+    written = {}
+    report = list(export(read_jsonl(path), written.__setitem__, workers=1))
+    errors = {entry["id"]: entry["error"] for entry in report}
+    assert errors["1"] is None and errors["x"] is None
+    assert errors["2"].startswith("JSONDecodeError")
+    assert sorted(written) == ["1.pdf", "x.pdf"]
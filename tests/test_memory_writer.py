@@ -0,0 +1,57 @@
+import time
+import threading
+
+from agent.memory_writer import MemoryWriter
+
+
+def config(user_id, thread_id):
+    return {"configurable": {"user_id": user_id, "thread_id": thread_id}}
+
+
+class Recorder:
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+        self.calls = []
+        self.running = set()
+        self.overlaps = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, state, config, store):
+        user_id = config["configurable"]["user_id"]
+        with self._lock:
+            self.overlaps += user_id in self.running
+            self.running.add(user_id)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.running.discard(user_id)
+            self.calls.append((user_id, state))
+
+
+def test_threads_of_a_user_are_kept_apart():
+    recorder = Recorder()
+    writer = MemoryWriter(recorder, store=None, debounce=10)
+    writer.submit("A", config("u", "a"))
+    writer.submit("B", config("u", "b"))
+    writer.close()
+    assert sorted(state for _, state in recorder.calls) == ["A", "B"]
+
+
+def test_turns_of_a_thread_are_debounced_to_the_latest():
+    recorder = Recorder()
+    writer = MemoryWriter(recorder, store=None, debounce=0.2)
+    for state in ("A1", "A2", "A3"):
+        writer.submit(state, config("u", "a"))
+    writer.close()
+    assert recorder.calls == [("u", "A3")]
+
+
+def test_a_user_runs_one_extraction_at_a_time_in_order():
+    recorder = Recorder(seconds=0.05)
+    writer = MemoryWriter(recorder, store=None, debounce=0)
+    for thread_id in ("a", "b", "c"):
+        writer.submit(thread_id.upper(), config("u", thread_id))
+        writer.submit(thread_id.upper(), config("v", thread_id))
+    writer.close()
+    assert recorder.overlaps == 0
+    assert [state for user_id, state in recorder.calls if user_id == "u"] == ["A", "B", "C"]
+    assert [state for user_id, state in recorder.calls if user_id == "v"] == ["A", "B", "C"]
@@ -0,0 +1,35 @@
+"""Smoke tests of the persistence backends, driven by the fake model (run with `python -m pytest`)."""
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+
+def test_sqlite_turn(tmp_path):
+    path = str(tmp_path / "saveup.sqlite")
+    agent = load_agent(FakeChatModel(), persistence_backend="sqlite", sqlite_path=path)
+    response, interruption = agent.invoke("Hi!", thread_id="1", user_id="1")
+    assert interruption is None
+    assert response["messages"][-1].content
+
+    _, interruption = agent.invoke("Please make my plan", thread_id="1", user_id="1")
+    assert interruption is not None
+    response, interruption = agent.invoke("ACCEPT", thread_id="1", user_id="1")
+    assert interruption is None
+    assert "financial_plan" in response
+    agent.memory_writer.close()
+
+    # A restart on the same file sees the thread
+    agent = load_agent(FakeChatModel(), persistence_backend="sqlite", sqlite_path=path)
+    assert agent.load_thread("1", "1") is not None
+    agent.memory_writer.close()
+
+
+def test_memory_compaction():
+    # `MemoryPersistence.compact` edits MemorySaver's internals; this breaks if langgraph changes them
+    agent = load_agent(FakeChatModel(), checkpoints_per_thread=2)
+    for turn in range(10):
+        agent.invoke(f"Turn {turn}", thread_id="1", user_id="1")
+    checkpoints = agent.within_thread_memory.storage["1"][""]
+    assert len(checkpoints) <= 4
+    turns, interruption, _ = agent.load_thread("1", "1")
+    assert len(turns) == 20
+    assert interruption is None
+    agent.memory_writer.close()
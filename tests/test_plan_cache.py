@@ -0,0 +1,19 @@
+from agent.plan_cache import plan_cache_key
+
+INFORMATION = {"financial_goal": "Buy a TV", "goal_amount": 400, "time_period": "5 months",
+               "monthly_expenses": 600, "salary": 700}
+
+
+def key(**changes):
+    return plan_cache_key({**INFORMATION, **changes}, "v1", "model")
+
+
+def test_same_meaning_same_key():
+    assert key(savings=0, goal_amount="$400") == key(savings="0", financial_goal="buy a  tv")
+    assert key(current_savings=350) == key(savings=350)
+
+
+def test_keys_beyond_the_profile_tell_plans_apart():
+    # Both reach the plan prompt, so they must not share a cached plan
+    assert key(savings=0, current_savings=0) != key(savings=0, current_savings=350)
+    assert key(savings=0) != key(savings=0, debt=5000)
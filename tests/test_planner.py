@@ -0,0 +1,30 @@
+import pytest
+
+from agent.planner import compute_plan_figures, to_amount
+from agent.profile import canonical_financial_information
+
+
+@pytest.mark.parametrize("value, amount", [
+    (400, 400.0), ("$1,200.50", 1200.5), ("USD 3 000", 3000.0), ("1,5", 1.5),
+    ("1.2k", 1200.0), ("2.5 million", 2_500_000.0), ("400 dollars", 400.0), ("none", None),
+])
+def test_to_amount(value, amount):
+    assert to_amount(value) == amount
+
+
+def test_savings_covering_the_goal_are_feasible():
+    figures = compute_plan_figures({"goal_amount": 400, "savings": 500, "time_period": "5 months",
+                                    "monthly_expenses": 600, "salary": 500})
+    assert figures["gap_to_goal"] == 0
+    assert figures["feasible"]
+
+
+def test_missing_savings_are_unknown_not_zero():
+    assert compute_plan_figures({"goal_amount": 400, "time_period": "5 months",
+                                 "monthly_expenses": 600, "salary": 700}) is None
+
+
+def test_savings_under_an_alias_count():
+    information = canonical_financial_information({"goal_amount": 400, "current_savings": 350, "time_period": "5 months",
+                                                   "monthly_expenses": 600, "salary": 700})
+    assert compute_plan_figures(information)["gap_to_goal"] == 50
@@ -0,0 +1,30 @@
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+
+def test_edit_with_extra_keys_and_formatted_amounts():
+    agent = load_agent(FakeChatModel())
+    _, interruption = agent.invoke("Please make my plan", thread_id="1", user_id="1")
+    assert interruption is not None
+
+    # The model may add keys beyond the profile to the tool call; the table lets the user edit them too
+    edit = {"type": "edit", "financial_information": {"savings": "$1,200", "current_savings": "1200"}}
+    response, interruption = agent.invoke(edit, thread_id="1", user_id="1")
+    assert interruption is None
+    assert "financial_plan" in response
+    profile = agent.across_thread_memory.get(("1", "user_information"), "financial_information").value
+    assert profile["financial_information"]["savings"] == 1200.0
+    assert "current_savings" not in profile["financial_information"]
+    agent.memory_writer.close()
+
+
+def test_a_user_over_their_store_quota_still_gets_the_plan():
+    agent = load_agent(FakeChatModel(), store_items_per_user=0)
+    _, interruption = agent.invoke("Please make my plan", thread_id="1", user_id="1")
+    assert interruption is not None
+    # Neither the thread index entry, the profile edit nor the latest plan fit in the quota
+    response, interruption = agent.invoke({"type": "edit", "financial_information": {"savings": 100}},
+                                          thread_id="1", user_id="1")
+    assert interruption is None
+    assert "financial_plan" in response
+    assert agent.across_thread_memory.usage("1") == (0, 0)
+    agent.memory_writer.close()
@@ -0,0 +1,76 @@
+import multiprocessing
+
+import pytest
+from langgraph.store.memory import InMemoryStore
+
+from agent.persistence import SqlitePersistence
+from agent.sharded_store import ShardedStore, StoreQuotaExceeded
+
+INCREMENTS = 50
+
+
+def test_quotas_and_eviction():
+    store = ShardedStore(lambda user_id: InMemoryStore(), max_users=2, max_items_per_user=2, max_bytes_per_user=100)
+    store.put(("a", "notes"), "1", {"text": "x"})
+    store.put(("a", "notes"), "2", {"text": "x"})
+    with pytest.raises(StoreQuotaExceeded):
+        store.put(("a", "notes"), "3", {"text": "x"})
+    with pytest.raises(StoreQuotaExceeded):
+        store.put(("a", "notes"), "1", {"text": "x" * 100})
+    # Replacing or deleting an item frees its share of the quota
+    store.delete(("a", "notes"), "2")
+    store.put(("a", "notes"), "3", {"text": "x"})
+    assert store.usage("a")[0] == 2
+
+    # "a" is the least recently used user when "c" arrives
+    store.put(("b", "notes"), "1", {"text": "x"})
+    store.put(("c", "notes"), "1", {"text": "x"})
+    assert store.get(("b", "notes"), "1") is not None
+    assert store.get(("a", "notes"), "1") is None
+
+
+def test_sqlite_quotas_are_kept_in_the_database(tmp_path):
+    path = str(tmp_path / "saveup.sqlite")
+    store = SqlitePersistence(path, store_limits={"max_items_per_user": 2, "max_bytes_per_user": 100}).store
+    store.put(("a", "notes"), "1", {"text": "x"})
+    store.put(("a", "notes"), "2", {"text": "x"})
+    with pytest.raises(StoreQuotaExceeded):
+        store.put(("a", "notes"), "3", {"text": "x"})
+    with pytest.raises(StoreQuotaExceeded):
+        store.put(("a", "notes"), "1", {"text": "x" * 100})
+    # A rejected put writes nothing
+    assert store.get(("a", "notes"), "3") is None
+    assert store.get(("a", "notes"), "1").value == {"text": "x"}
+    store.delete(("a", "notes"), "2")
+    store.put(("b", "notes"), "1", {"text": "x"})
+    assert store.usage("a") == (1, 13)
+
+    # Another process sees the same usage, and a database without it gets it back from its items
+    assert SqlitePersistence(path).store.usage("a") == (1, 13)
+    reopened = SqlitePersistence(path)
+    with reopened.checkpointer.cursor() as cursor:
+        cursor.execute("DROP TABLE store_usage")
+        cursor.execute("DROP TABLE store_item_usage")
+    assert SqlitePersistence(path).store.usage("b") == (1, 13)
+
+
+def increment(path):
+    store = SqlitePersistence(path).store
+    namespace = ("user", "counters")
+    for _ in range(INCREMENTS):
+        with store.lock(namespace, "count"):
+            item = store.get(namespace, "count")
+            store.put(namespace, "count", {"value": (item.value["value"] if item else 0) + 1})
+
+
+def test_sqlite_key_lock_across_processes(tmp_path):
+    path = str(tmp_path / "saveup.sqlite")
+    SqlitePersistence(path)
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=increment, args=(path,)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert SqlitePersistence(path).store.get(("user", "counters"), "count").value["value"] == 2 * INCREMENTS
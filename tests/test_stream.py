@@ -0,0 +1,16 @@
+from benchmark.fake_llm import FakeChatModel, load_agent
+
+
+def test_a_stream_closed_early_still_records_the_turn(monkeypatch):
+    agent = load_agent(FakeChatModel())
+    submitted = []
+    monkeypatch.setattr(agent.get_app().memory_writer, "submit", lambda state, config: submitted.append(config))
+
+    # Streamlit reruns the script mid-reply, which closes the generator
+    events = agent.stream("How am I doing?", thread_id="1", user_id="1")
+    assert next(events)["type"] == "token"
+    events.close()
+
+    assert [thread["id"] for thread in agent.get_threads("1")] == ["1"]
+    assert [config["configurable"]["thread_id"] for config in submitted] == ["1"]
+    agent.memory_writer.close()